@@ -123,7 +123,6 @@ Then parser) and the identity element being Return(None).
 # terms of the GNU Lesser General Public License.
 
 from __future__ import print_function
-import itertools
 from operator import itemgetter
 import six
 # noinspection PyUnresolvedReferences
@@ -131,6 +130,7 @@ from six.moves import range
 from parcon import static
 import re
 import collections
+import threading
 from parcon.graph import Graphable as _Graphable
 from parcon import railroad as _rr
 from parcon.railroad import regex as _rr_regex
@@ -210,6 +210,11 @@ class EUnsatisfiable(Expectation):
         return "EUnsatisfiable()"
 
 
+# EUnsatisfiable doesn't hold any state, so parsers share this one instance
+# instead of creating a new one every time they match something
+_unsatisfiable = EUnsatisfiable()
+
+
 class EStringLiteral(Expectation):
     """
     An expectation indicating that some literal string was expected. When
@@ -341,6 +346,8 @@ class Result(object):
     ...
     No
     """
+    __slots__ = ("end", "value", "expected")
+    
     def __init__(self, end, value, expected):
         self.end = end
         self.value = value
@@ -353,6 +360,8 @@ class Result(object):
         self.expected = expected
     
     def __nonzero__(self):
+        # Parcon's own parsers check end directly instead of using this since
+        # they do so on every step of a parse, and calling this is much slower
         return self.end is not None
 
     __bool__ = __nonzero__
@@ -515,13 +524,33 @@ def promote(value):
     returns the value as is if it's an instance of Parser, or Literal(value) if
     the value is a string.
     """
-    if isinstance(value, Parser):
-        return value
-    if isinstance(value, six.string_types):
+    cls = type(value)
+    to_literal = _promote_to_literal.get(cls)
+    if to_literal is None:
+        to_literal = (not isinstance(value, Parser)
+                      and isinstance(value, six.string_types))
+        _promote_to_literal[cls] = to_literal
+    if to_literal:
         return Literal(value)
     return value
 
 
+# Maps each type promote has seen to whether values of that type get turned
+# into a Literal, so that promote only has to do its isinstance checks once
+# per type
+_promote_to_literal = {}
+
+
+def _parse_function(parser):
+    # Returns a function that calls the specified parser's parse method, for
+    # parsers that want to look it up once instead of on every call. This is
+    # just parser.parse, except for Forwards, whose parse method changes every
+    # time they're set.
+    if isinstance(parser, Forward):
+        return lambda text, position, end, space: parser.parse(text, position, end, space)
+    return parser.parse
+
+
 # These are the various operators provided on every parser. The documentation
 # for each one is provided as part of the Parcon module documentation.
 
@@ -598,6 +627,11 @@ def op_call(parser, *args, **kwargs):
     raise NotImplementedError
 
 
+# {id(parser): (parser, text, end, {position: new position})} for the
+# parse_string call running on the current thread, if any; see Parser.consume
+_consume_state = threading.local()
+
+
 class Parser(object):
     """
     A parser. This class cannot itself be instantiated; you can only use one of
@@ -626,25 +660,54 @@ class Parser(object):
         """
         if whitespace is None:
             whitespace = Whitespace()
-        result = self.parse(string, 0, len(string), whitespace)
-        if result:
-            if not all: # We got a result back and we're not trying to match
-                # everything, so regardless of what the result was, we should
-                # return it.
-                return result.value
-            # Result matched and we're trying to match everything, so we ask
-            # the whitespace parser to consume everything at the end, then
-            # check to see if the end position is equal to the string length,
-            # and if it is, we return the value.
-            if whitespace.consume(string, result.end, len(string)) == len(string):
-                return result.value
+        # Set up the whitespace memo used by consume for the length of this
+        # parse, unless we're being called from inside another parse_string
+        # that already did
+        outermost = getattr(_consume_state, "caches", None) is None
+        if outermost:
+            _consume_state.caches = {}
+        try:
+            result = self.parse(string, 0, len(string), whitespace)
+            if result:
+                if not all: # We got a result back and we're not trying to match
+                    # everything, so regardless of what the result was, we should
+                    # return it.
+                    return result.value
+                # Result matched and we're trying to match everything, so we ask
+                # the whitespace parser to consume everything at the end, then
+                # check to see if the end position is equal to the string length,
+                # and if it is, we return the value.
+                if whitespace.consume(string, result.end, len(string)) == len(string):
+                    return result.value
+        finally:
+            if outermost:
+                _consume_state.caches = None
         raise ParseException("Parse failure: " + format_failure(result.expected), result.expected)
     
     def consume(self, text, position, end):
+        # Whitespace parsers get asked to consume space at the same position
+        # over and over (once for every alternative of a First, for example),
+        # so while parse_string is running, remember where we ended up for
+        # each position. The parser and text are kept in the cache rather
+        # than just their id()s so that a different object can't be mistaken
+        # for them.
+        caches = getattr(_consume_state, "caches", None)
+        positions = None
+        if caches is not None:
+            cache = caches.get(id(self))
+            if cache is None or cache[1] is not text or cache[2] != end:
+                cache = caches[id(self)] = (self, text, end, {})
+            positions = cache[3]
+            new_position = positions.get(position)
+            if new_position is not None:
+                return new_position
+        start = position
         result = self.parse(text, position, end, Invalid())
-        while result:
+        while result.end is not None:
             position = result.end
             result = self.parse(text, position, end, Invalid())
+        if positions is not None:
+            positions[start] = position
         return position
         
     # All of the operators available to parsers
@@ -714,7 +777,11 @@ class Invalid(_GParser):
         # every parser. (If you want to see why, add a call to parse_whitespace
         # to this method, then try parsing any string with something like
         # Literal("a"), and you'll see what happens.)
-        return failure((position, EUnsatisfiable()))
+        return failure((position, _unsatisfiable))
+    
+    def consume(self, text, position, end):
+        # Invalid never matches, so there's never any space to consume
+        return position
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Invalid")
@@ -733,12 +800,31 @@ class Literal(_GRParser):
     """
     def __init__(self, text):
         self.text = text
+        # Single-character literals are by far the most common kind (they're
+        # what strings like "," and "(" get promoted to), so they get a parse
+        # that compares one character instead of slicing the text
+        if len(text) == 1 and type(self).parse in (Literal.parse, SignificantLiteral.parse):
+            self.parse = self._parse_char
     
     def parse(self, text, position, end, space):
         position = space.consume(text, position, end)
-        expected_end = position + len(self.text)
-        if expected_end <= end and text[position:expected_end] == self.text:
-            return match(expected_end, None, [(expected_end, EUnsatisfiable())])
+        try:
+            found = text.startswith(self.text, position, end)
+        except AttributeError:
+            # Not a real string (parcon.socket.LazyString, for example), so
+            # compare a slice of it instead
+            expected_end = position + len(self.text)
+            found = expected_end <= end and text[position:expected_end] == self.text
+        if found:
+            expected_end = position + len(self.text)
+            return match(expected_end, None, [(expected_end, _unsatisfiable)])
+        else:
+            return failure((position, EStringLiteral(self.text)))
+    
+    def _parse_char(self, text, position, end, space):
+        position = space.consume(text, position, end)
+        if position < end and text[position] == self.text:
+            return match(position + 1, None, [(position + 1, _unsatisfiable)])
         else:
             return failure((position, EStringLiteral(self.text)))
     
@@ -762,9 +848,22 @@ class SignificantLiteral(Literal):
     """
     def parse(self, text, position, end, space):
         position = space.consume(text, position, end)
-        expected_end = position + len(self.text)
-        if expected_end <= end and text[position:expected_end] == self.text:
-            return match(expected_end, self.text, [(expected_end, EUnsatisfiable())])
+        try:
+            found = text.startswith(self.text, position, end)
+        except AttributeError:
+            # Same as Literal.parse
+            expected_end = position + len(self.text)
+            found = expected_end <= end and text[position:expected_end] == self.text
+        if found:
+            expected_end = position + len(self.text)
+            return match(expected_end, self.text, [(expected_end, _unsatisfiable)])
+        else:
+            return failure((position, EStringLiteral(self.text)))
+    
+    def _parse_char(self, text, position, end, space):
+        position = space.consume(text, position, end)
+        if position < end and text[position] == self.text:
+            return match(position + 1, self.text, [(position + 1, _unsatisfiable)])
         else:
             return failure((position, EStringLiteral(self.text)))
     
@@ -793,7 +892,7 @@ class AnyCase(_GRParser):
         position = space.consume(text, position, end)
         expected_end = position + len(self.text)
         if expected_end <= end and text[position:expected_end].lower() == self.text:
-            return match(expected_end, None, [(expected_end, EUnsatisfiable())])
+            return match(expected_end, None, [(expected_end, _unsatisfiable)])
         else:
             return failure((position, EStringLiteral(self.text)))
     
@@ -808,6 +907,43 @@ class AnyCase(_GRParser):
         return "AnyCase(%s)" % repr(self.text)
 
 
+def _char_class_regex(chars):
+    # Returns a compiled regex matching any run (including an empty one) of
+    # the specified characters, or None if chars isn't a set of one-character
+    # strings that a character class can be built from
+    if (not isinstance(chars, frozenset) or not chars or not
+            all(isinstance(c, six.string_types) and len(c) == 1 for c in chars)):
+        return None
+    return re.compile("[" + "".join(re.escape(c) for c in sorted(chars)) + "]*")
+
+
+# Maps the characters given to CharIn to the set of those characters and the
+# regex built from them by _char_class_regex. This is emptied whenever it grows
+# past _char_set_cache_limit entries.
+_char_set_cache = {}
+_char_set_cache_limit = 1024
+
+
+def _char_set(chars):
+    # Returns (set, regex), where set is a frozenset of the specified
+    # characters and regex is _char_class_regex(set). Every Digit(), Alpha()
+    # and so on in a grammar uses the same characters, so they share one set
+    # and one regex instead of each building their own. If the characters
+    # can't be put in a set, (chars, None) is returned.
+    try:
+        key = (type(chars), tuple(chars) if isinstance(chars, list) else chars)
+        entry = _char_set_cache.get(key)
+        if entry is None:
+            char_set = frozenset(chars)
+            entry = char_set, _char_class_regex(char_set)
+            if len(_char_set_cache) >= _char_set_cache_limit:
+                _char_set_cache.clear()
+            _char_set_cache[key] = entry
+        return entry
+    except TypeError:
+        return chars, None
+
+
 class CharIn(_GRParser):
     """
     A parser that matches a single character as long as it is in the specified
@@ -816,15 +952,33 @@ class CharIn(_GRParser):
     """
     def __init__(self, chars):
         self.chars = chars
+        # Checking a set is constant time, whereas checking a string or a list
+        # means scanning through it
+        char_set, regex = _char_set(chars)
+        self._chars = char_set
+        self._run_regex = None
+        # Comparing the underlying functions since Python 2 creates a new
+        # unbound method every time CharIn.parse is looked up
+        if (six.get_unbound_function(type(self).parse)
+                is six.get_unbound_function(CharIn.parse)):
+            self._run_regex = regex
     
     def parse(self, text, position, end, space):
         position = space.consume(text, position, end)
-        expected_end = position + 1
-        if position < end and text[position:expected_end] in self.chars:
-            return match(expected_end, text[position], [(expected_end, EUnsatisfiable())])
+        if position < end and text[position] in self._chars:
+            return match(position + 1, text[position], [(position + 1, _unsatisfiable)])
         else:
             return failure([(position, EAnyCharIn(self.chars))])
     
+    def consume(self, text, position, end):
+        # When used as a whitespace parser, skip the whole run of characters
+        # with one regex match instead of parsing them one at a time. Things
+        # like parcon.socket.LazyString that aren't real strings can't be
+        # handed to a regex, so they still go through Parser.consume.
+        if self._run_regex is not None and isinstance(text, six.string_types):
+            return self._run_regex.match(text, position, end).end()
+        return Parser.consume(self, text, position, end)
+    
     def do_graph(self, graph):
         graph.add_node(id(self), label='CharIn:\n%s' % repr(self.chars))
         return []
@@ -836,6 +990,19 @@ class CharIn(_GRParser):
         return "CharIn(" + repr(self.chars) + ")"
 
 
+def _char_run(parser):
+    # Returns (char_in, regex) if parser is a plain CharIn, possibly wrapped in
+    # a Name, where regex matches a run of the characters that CharIn accepts.
+    # ZeroOrMore and OneOrMore use this to match a whole run of characters in
+    # one go when there's no whitespace to skip between them. Returns None for
+    # any other parser.
+    while type(parser) is Name:
+        parser = parser.parser
+    if not isinstance(parser, CharIn) or parser._run_regex is None:
+        return None
+    return parser, parser._run_regex
+
+
 class CharNotIn(_GParser):
     """
     A parser that matches a single character as long as it is not in the
@@ -843,12 +1010,13 @@ class CharNotIn(_GParser):
     """
     def __init__(self, chars):
         self.chars = chars
+        # Same as CharIn
+        self._chars = _char_set(chars)[0]
     
     def parse(self, text, position, end, space):
         position = space.consume(text, position, end)
-        expected_end = position + 1
-        if position < end and text[position:expected_end] not in self.chars:
-            return match(expected_end, text[position], [(expected_end, EUnsatisfiable())])
+        if position < end and text[position] not in self._chars:
+            return match(position + 1, text[position], [(position + 1, _unsatisfiable)])
         else:
             return failure([(position, EAnyCharNotIn(self.chars))])
     
@@ -926,9 +1094,6 @@ class Whitespace(CharIn):
     """
     def __init__(self):
         CharIn.__init__(self, whitespace)
-        # Speed optimization
-        regex = re.compile(r"[ \t\r\n]*")
-        self.consume = lambda t, p, e: regex.match(t, p, e).end()
     
     def __repr__(self):
         return "Whitespace()"
@@ -946,7 +1111,7 @@ class AnyChar(_GRParser):
     def parse(self, text, position, end, space):
         position = space.consume(text, position, end)
         if position < end: # At least one char left
-            return match(position + 1, text[position], [(position + 1, EUnsatisfiable())])
+            return match(position + 1, text[position], [(position + 1, _unsatisfiable)])
         else:
             return failure([(position, EAnyChar())])
     
@@ -983,10 +1148,12 @@ class Except(_GRParser):
     def parse(self, text, position, end, space):
         # May want to parse space to make sure the two parsers are in sync
         result = self.parser.parse(text, position, end, space)
-        if not result:
-            return failure(result.expected)
+        if result.end is None:
+            # Failed results are passed along as they are instead of being
+            # copied into a new one here and in the parsers below
+            return result
         avoid_result = self.avoid_parser.parse(text, position, end, space)
-        if avoid_result:
+        if avoid_result.end is not None:
             return failure([(position, EStringLiteral("(TBD: except)"))])
         return result
     
@@ -1013,14 +1180,27 @@ class ZeroOrMore(_GRParser):
     def __init__(self, parser):
         self.parser = parser
         self.railroad_children = [parser]
+        self._char_run = _char_run(parser)
     
     def parse(self, text, position, end, space):
+        if (self._char_run is not None and type(space) is Invalid
+                and isinstance(text, six.string_types)):
+            # Repeating a CharIn with no whitespace in between, which is what
+            # something like Exact(Digit()[...]) does, so let the regex
+            # engine find the whole run at once. (Only for real strings,
+            # since re can't search things like parcon.socket.LazyString.)
+            char_in, regex = self._char_run
+            new_position = regex.match(text, position, end).end()
+            return match(new_position, list(text[position:new_position]),
+                    [(new_position, EAnyCharIn(char_in.chars))])
         result = []
-        parserResult = self.parser.parse(text, position, end, space)
-        while parserResult:
-            result.append(parserResult.value)
+        append = result.append
+        parse = self.parser.parse
+        parserResult = parse(text, position, end, space)
+        while parserResult.end is not None:
+            append(parserResult.value)
             position = parserResult.end
-            parserResult = self.parser.parse(text, position, end, space)
+            parserResult = parse(text, position, end, space)
         return match(position, result, parserResult.expected)
     
     def do_graph(self, graph):
@@ -1043,16 +1223,28 @@ class OneOrMore(_GRParser):
     def __init__(self, parser):
         self.parser = parser
         self.railroad_children = [parser]
+        self._char_run = _char_run(parser)
     
     def parse(self, text, position, end, space):
+        if (self._char_run is not None and type(space) is Invalid
+                and isinstance(text, six.string_types)):
+            # Same as ZeroOrMore
+            char_in, regex = self._char_run
+            new_position = regex.match(text, position, end).end()
+            expected = [(new_position, EAnyCharIn(char_in.chars))]
+            if new_position == position:
+                return failure(expected)
+            return match(new_position, list(text[position:new_position]), expected)
         result = []
-        parserResult = self.parser.parse(text, position, end, space)
-        while parserResult:
-            result.append(parserResult.value)
+        append = result.append
+        parse = self.parser.parse
+        parserResult = parse(text, position, end, space)
+        while parserResult.end is not None:
+            append(parserResult.value)
             position = parserResult.end
-            parserResult = self.parser.parse(text, position, end, space)
+            parserResult = parse(text, position, end, space)
         if len(result) == 0:
-            return failure(parserResult.expected)
+            return parserResult
         return match(position, result, parserResult.expected)
     
     def do_graph(self, graph):
@@ -1090,30 +1282,41 @@ class Then(_GRParser):
         self.first = promote(first)
         self.second = promote(second)
         self.railroad_children = [self.first, self.second]
+        # a + b + c + d builds Then(Then(Then(a, b), c), d), so collect all of
+        # the parsers in a chain of Thens into one tuple that parse can loop
+        # over instead of going through one Then per parser. Merging values
+        # the way Then does gives the same result however the Thens are
+        # nested.
+        self._parsers = (self._chain(self.first) + self._chain(self.second))
+        self._parse_functions = tuple(_parse_function(p) for p in self._parsers)
+    
+    @staticmethod
+    def _chain(parser):
+        if type(parser) is Then:
+            return parser._parsers
+        return (parser,)
     
     def parse(self, text, position, end, space):
-        firstResult = self.first.parse(text, position, end, space)
-        if not firstResult:
-            return failure(firstResult.expected)
-        position = firstResult.end
-        secondResult = self.second.parse(text, position, end, space)
-        if not secondResult:
-            return failure(firstResult.expected + secondResult.expected)
-        position = secondResult.end
-        expectations = firstResult.expected + secondResult.expected
-        a, b = firstResult.value, secondResult.value
-        if a is None:
-            return match(position, b, expectations)
-        elif b is None:
-            return match(position, a, expectations)
-        if type(a) == tuple and type(b) == tuple:
-            return match(position, a + b, expectations)
-        elif type(a) == tuple:
-            return match(position, a + (b,), expectations)
-        elif type(b) == tuple:
-            return match(position, (a,) + b, expectations)
-        else:
-            return match(position, (a, b), expectations)
+        expectations = []
+        value = None
+        for parse in self._parse_functions:
+            result = parse(text, position, end, space)
+            expectations.extend(result.expected)
+            if result.end is None:
+                return failure(expectations)
+            position = result.end
+            b = result.value
+            if b is None:
+                continue
+            if value is None:
+                value = b
+            # Exact type checks (named tuples aren't merged, see above), and
+            # each value's type is only checked once
+            elif type(value) is tuple:
+                value = value + b if type(b) is tuple else value + (b,)
+            else:
+                value = (value,) + b if type(b) is tuple else (value, b)
+        return match(position, value, expectations)
     
     
     def do_graph(self, graph):
@@ -1146,10 +1349,10 @@ class Discard(_GRParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
+        if result.end is not None:
             return match(result.end, None, result.expected)
         else:
-            return failure(result.expected)
+            return result
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Discard")
@@ -1179,12 +1382,15 @@ class First(_GRParser):
             parsers = parsers[0]
         self.parsers = [promote(p) for p in parsers]
         self.railroad_children = self.parsers
+        self._parse_functions = tuple(_parse_function(p) for p in self.parsers)
     
     def parse(self, text, position, end, space):
         expectedForErrors = []
-        for parser in self.parsers:
-            result = parser.parse(text, position, end, space)
-            if result:
+        for parse in self._parse_functions:
+            result = parse(text, position, end, space)
+            if result.end is not None:
+                if not expectedForErrors:
+                    return result
                 return match(result.end, result.value, result.expected + expectedForErrors)
             else:
                 expectedForErrors += result.expected
@@ -1232,7 +1438,7 @@ class Longest(_GRParser):
         successful = []
         for parser in self.parsers:
             result = parser.parse(text, position, end, space)
-            if result:
+            if result.end is not None:
                 successful.append(result)
             else:
                 expectedForErrors += result.expected
@@ -1275,12 +1481,23 @@ class Translate(_GRParser):
         self.parser = parser
         self.function = function
         self.railroad_children = [self.parser]
+        # p[f][g] builds Translate(Translate(p, f), g); parse that as p
+        # followed by f and then g in one step instead of one per Translate
+        if type(parser) is Translate:
+            self._target = parser._target
+            self._functions = parser._functions + (function,)
+        else:
+            self._target = parser
+            self._functions = (function,)
     
     def parse(self, text, position, end, space):
-        result = self.parser.parse(text, position, end, space)
-        if not result:
-            return failure(result.expected)
-        return match(result.end, self.function(result.value), result.expected)
+        result = self._target.parse(text, position, end, space)
+        if result.end is None:
+            return result
+        value = result.value
+        for function in self._functions:
+            value = function(value)
+        return match(result.end, value, result.expected)
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Translate")
@@ -1357,7 +1574,7 @@ class Optional(_GRParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
+        if result.end is not None:
             return result
         else:
             return match(position, self.default, result.expected)
@@ -1389,23 +1606,50 @@ class Repeat(_GParser):
         self.parser = parser
         self.min = min
         self.max = max
+        # Work out which loop we need now instead of on every call
+        if (six.get_unbound_function(type(self).parse)
+                is six.get_unbound_function(Repeat.parse)):
+            if max is None:
+                self.parse = self._parse_unbounded
+            elif max != 0 and not (min == 1 and max == 1):
+                self.parse = self._parse_bounded
     
     def parse(self, text, position, end, space):
         if self.max == 0: # This does actually happen some times;
             # specifically, it came up in a parser that James Stoker was
             # writing to parse CIDRs in BGP packets
-            return match(position, [], (position, EUnsatisfiable()))
+            return match(position, [], (position, _unsatisfiable))
         if self.min == 1 and self.max == 1: # Optimization to short-circuit
             # into the underlying parser if we're parsing exactly one of it
             return self.parser.parse(text, position, end, space)
+        if self.max is None:
+            return self._parse_unbounded(text, position, end, space)
+        return self._parse_bounded(text, position, end, space)
+    
+    def _parse_bounded(self, text, position, end, space):
         result = []
+        parse = self.parser.parse
         parse_result = None
-        for i in (range(self.max) if self.max is not None else itertools.count(0)):
-            parse_result = self.parser.parse(text, position, end, space)
-            if not parse_result:
+        remaining = self.max
+        while remaining > 0:
+            parse_result = parse(text, position, end, space)
+            if parse_result.end is None:
                 break
             position = parse_result.end
             result.append(parse_result.value)
+            remaining -= 1
+        if self.min and len(result) < self.min:
+            return failure(parse_result.expected)
+        return match(position, result, parse_result.expected)
+    
+    def _parse_unbounded(self, text, position, end, space):
+        result = []
+        parse = self.parser.parse
+        parse_result = parse(text, position, end, space)
+        while parse_result.end is not None:
+            position = parse_result.end
+            result.append(parse_result.value)
+            parse_result = parse(text, position, end, space)
         if self.min and len(result) < self.min:
             return failure(parse_result.expected)
         return match(position, result, parse_result.expected)
@@ -1460,8 +1704,8 @@ class Keyword(_GRParser):
         else:
             terminator = space
         result = self.parser.parse(text, position, end, space)
-        if not result:
-            return failure(result.expected)
+        if result.end is None:
+            return result
         if self.exact_terminator:
             t_space = Invalid()
         else:
@@ -1469,8 +1713,8 @@ class Keyword(_GRParser):
         if self.or_end:
             terminator = terminator | End()
         terminator_result = terminator.parse(text, result.end, end, t_space)
-        if not terminator_result:
-            return failure(terminator_result.expected)
+        if terminator_result.end is None:
+            return terminator_result
         return result
     
     def do_graph(self, graph):
@@ -1524,6 +1768,24 @@ class Forward(_GRParser):
     def __init__(self, parser=None):
         self.parser = parser
     
+    @property
+    def parser(self):
+        return self._parser
+    
+    @parser.setter
+    def parser(self, parser):
+        self._parser = parser
+        # Hand parse calls straight to the underlying parser instead of going
+        # through Forward.parse on every recursion. Forwards pointing at other
+        # Forwards still go through Forward.parse since the other Forward's
+        # parser can change out from under us.
+        if (parser is None or isinstance(parser, Forward)
+                or six.get_unbound_function(type(self).parse)
+                is not six.get_unbound_function(Forward.parse)):
+            self.__dict__.pop("parse", None)
+        else:
+            self.parse = parser.parse
+    
     @property
     def railroad_children(self):
         return [self.parser]
@@ -1600,8 +1862,8 @@ class InfixExpr(_GRParser):
     def parse(self, text, position, end, space):
         # Parse the first component
         component_result = self.component.parse(text, position, end, space)
-        if not component_result:
-            return failure(component_result.expected)
+        if component_result.end is None:
+            return component_result
         # Set up initial values from the first component
         value = component_result.value
         position = component_result.end
@@ -1614,7 +1876,7 @@ class InfixExpr(_GRParser):
             # Try each operator's op parser in sequence
             for op_parser, op_function in self.operators:
                 op_result = op_parser.parse(text, position, end, space)
-                if op_result:
+                if op_result.end is not None:
                     # This operator matched, so we break out of our loop
                     found_op = True
                     break
@@ -1627,7 +1889,7 @@ class InfixExpr(_GRParser):
             # We have an operator. Now we set the new position and try to parse
             # a component following it.
             component_result = self.component.parse(text, op_result.end, end, space)
-            if not component_result:
+            if component_result.end is None:
                 # Component didn't match, so we return the current value, along
                 # with the component's expectation and the expectations of the
                 # operator that matched
@@ -1681,11 +1943,11 @@ class Bind(_GParser):
     
     def parse(self, text, position, end, whitespace):
         first_result = self.parser.parse(text, position, end, whitespace)
-        if not first_result:
-            return failure(first_result.expected)
+        if first_result.end is None:
+            return first_result
         second_parser = self.function(first_result.value)
         second_result = second_parser.parse(text, first_result.end, end, whitespace)
-        if not second_result:
+        if second_result.end is None:
             return failure(second_result.expected + first_result.expected)
         return match(second_result.end, second_result.value, second_result.expected)
     
@@ -1710,7 +1972,7 @@ class Return(_GRParser):
         self.value = value
     
     def parse(self, text, position, end, whitespace):
-        return match(position, self.value, [(position, EUnsatisfiable())])
+        return match(position, self.value, [(position, _unsatisfiable)])
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Return:\n%s" % repr(self.value))
@@ -1755,7 +2017,7 @@ class Chars(_GParser):
             return failure([(end, EAnyChar())])
         result = text[position:position + self.number]
         end_position = position + self.number
-        return match(end_position, result, [(end_position, EUnsatisfiable())])
+        return match(end_position, result, [(end_position, _unsatisfiable)])
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Chars: %s chars" % self.number)
@@ -1811,7 +2073,7 @@ class Word(Parser):
         if self.max is None or total_consumed < self.max:
             expected = (new_position, EAnyCharIn(self.chars))
         else:
-            expected = (new_position, EUnsatisfiable())
+            expected = (new_position, _unsatisfiable)
         return match(new_position, result.group(0),
                 expected)
     
@@ -1832,10 +2094,10 @@ class Present(_GParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
-            return match(position, None, [(position, EUnsatisfiable())])
+        if result.end is not None:
+            return match(position, None, [(position, _unsatisfiable)])
         else:
-            return failure(result.expected)
+            return result
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Present")
@@ -1858,10 +2120,10 @@ class Preserve(_GParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
-            return match(position, result.value, [(position, EUnsatisfiable())])
+        if result.end is not None:
+            return match(position, result.value, [(position, _unsatisfiable)])
         else:
-            return failure(result.expected)
+            return result
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Preserve")
@@ -1890,11 +2152,11 @@ class And(_GRParser):
     def parse(self, text, position, end, space):
         # May want to parse space to make sure the two parsers are in sync
         result = self.parser.parse(text, position, end, space)
-        if not result:
-            return failure(result.expected)
+        if result.end is None:
+            return result
         check_result = self.check_parser.parse(text, position, end, space)
-        if not check_result:
-            return failure(check_result.expected)
+        if check_result.end is None:
+            return check_result
         return result
     
     def do_graph(self, graph):
@@ -1921,10 +2183,10 @@ class Not(_GParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
+        if result.end is not None:
             return failure([(position, EStringLiteral("(TBD: Not)"))])
         else:
-            return match(position, None, [(position, EUnsatisfiable())])
+            return match(position, None, [(position, _unsatisfiable)])
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Not")
@@ -1987,7 +2249,7 @@ class Regex(_RParser):
             result = list(regex_match.groups(""))
         else:
             result = [regex_match.group()] + list(regex_match.groups(""))
-        return match(position, result, [(position, EUnsatisfiable())])
+        return match(position, result, [(position, _unsatisfiable)])
     
     def create_railroad(self, options):
         expanded = _rr_regex.convert_regex(self.regex.pattern)
@@ -2052,7 +2314,7 @@ class Expected(Parser):
         if self.remove_whitespace:
             position = space.consume(text, position, end)
         result = self.parser.parse(text, position, end, space)
-        if not result:
+        if result.end is None:
             return failure([(position, ECustomExpectation(self.expected_message))])
         return result
     
@@ -2093,8 +2355,8 @@ class Limit(Parser):
     def parse(self, text, position, end, space):
         if isinstance(self.length, Parser):
             result = self.length.parse(text, position, end, space)
-            if not result:
-                return failure(result.expected)
+            if result.end is None:
+                return result
             position = result.end
             limit = position + result.value
         else:
@@ -2151,10 +2413,10 @@ class Tag(_GRParser):
     
     def parse(self, text, position, end, space):
         result = self.parser.parse(text, position, end, space)
-        if result:
+        if result.end is not None:
             return match(result.end, Pair(self.tag, result.value), result.expected)
         else:
-            return failure(result.expected)
+            return result
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="Tag:\n%s" % repr(self.tag))
@@ -2203,11 +2465,11 @@ class End(_GParser):
                 result_pos = new_position
             else:
                 result_pos = position
-            return match(result_pos, None, [(result_pos, EUnsatisfiable())])
+            return match(result_pos, None, [(result_pos, _unsatisfiable)])
         else:
             # Should we use new_position here? I need to experiment around
             # more with error messages and see.
-            return failure([(position, EUnsatisfiable())])
+            return failure([(position, _unsatisfiable)])
     
     def do_graph(self, graph):
         graph.add_node(id(self), label="End")
@@ -2224,6 +2486,12 @@ class Name(_GRParser):
         self.railroad_production_name = name
         self.railroad_production_delegate = parser
         self.railroad_children = [parser]
+        # Nothing to do but pass parse calls along, so hand them straight to
+        # the parser. Forwards are left alone since their parser can change.
+        if (six.get_unbound_function(type(self).parse)
+                is six.get_unbound_function(Name.parse)
+                and not isinstance(parser, Forward)):
+            self.parse = parser.parse
     
     def parse(self, text, position, end, space):
         return self.parser.parse(text, position, end, space)
@@ -2246,6 +2514,11 @@ class Description(_GRParser):
         self.parser = parser
         # This should /not/ have any railroad children to prevent a Description
         # object from being descended into when constructing railroad diagrams
+        # See Name.__init__
+        if (six.get_unbound_function(type(self).parse)
+                is six.get_unbound_function(Description.parse)
+                and not isinstance(parser, Forward)):
+            self.parse = parser.parse
     
     def parse(self, text, position, end, space):
         return self.parser.parse(text, position, end, space)
@@ -2308,10 +2581,20 @@ def flatten(value):
         # type(value) is tuple instead of isinstance(value, tuple) so that
         # named tuples are treated as normal objects and are not expanded
         return [value]
+    # Walk the nested lists and tuples with an explicit stack of iterators
+    # instead of recursing, which would build a new list for every level
     result = []
-    for item in value:
-        item = flatten(item)
-        result += list(item)
+    stack = [iter(value)]
+    while stack:
+        for item in stack[-1]:
+            if item is None:
+                continue
+            if isinstance(item, list) or type(item) is tuple:
+                stack.append(iter(item))
+                break
+            result.append(item)
+        else:
+            stack.pop()
     return result
 
 
@@ -2361,6 +2644,26 @@ def list_dict(list_of_pairs):
     return result
 
 
+def warmup(parser, sample="", whitespace=None):
+    """
+    Parses sample with the specified parser once, ignoring the result and any
+    failure, so that one-time costs, such as Python 3.11 and later
+    specializing the code that the parse runs, are paid before anything is
+    timed. sample should be a small, representative piece of input for the
+    grammar.
+    
+    This is only useful for benchmarks; parsing works the same whether or not
+    a parser has been warmed up.
+    
+    >>> warmup(number, "12.5")
+    >>> warmup(number, "not a number")
+    """
+    try:
+        parser.parse_string(sample, whitespace=whitespace)
+    except ParseException:
+        pass
+
+
 alpha_word = Word(alpha_chars)(name="alpha word")
 alphanum_word = Word(alphanum_chars)(name="alphanum word")
 id_word = Word(alphanum_chars, init_chars=alpha_chars)(name="id word")
@@ -39,6 +39,9 @@ import six
 
 sequence_type = static.Sequence()
 sequence_or_dict_type = static.Or(static.Sequence(), static.Type(dict))
+# Static types never change, so their matches methods can be looked up once
+_sequence_matches = sequence_type.matches
+_sequence_or_dict_matches = sequence_or_dict_type.matches
 
 class Result(object):
     """
@@ -60,12 +63,17 @@ class Result(object):
     else:
         print("Result failed")
     """
+    # _ok is whether or not this result succeeded, worked out up front so that
+    # formatters checking it don't need to call __nonzero__
+    __slots__ = ("text", "remainder", "_ok")
+    
     def __init__(self, text, remainder):
         self.text = text
         self.remainder = remainder
+        self._ok = text is not None
     
     def __nonzero__(self):
-        return self.text is not None
+        return self._ok
 
     __bool__ = __nonzero__
 
@@ -79,15 +87,22 @@ class Result(object):
         return self.text == other.text and self.remainder == other.remainder
 
 
+# All failed results look the same, so failure hands out this one instead of
+# creating a new one every time
+_FAILURE = Result(None, None)
+
+
 def failure():
     """
-    Method called by formatters to create a new Result object indicating
-    failure. Formatters typically fail when their input was not in the format
-    that they expected it to be, or for other reasons. Head, for example, fails
-    if the provided value is not a sequence, or if the sequence provided is
-    empty.
+    Method called by formatters to get a Result object indicating failure.
+    Formatters typically fail when their input was not in the format that they
+    expected it to be, or for other reasons. Head, for example, fails if the
+    provided value is not a sequence, or if the sequence provided is empty.
+    
+    The same Result object is returned every time, so it shouldn't be
+    modified.
     """
-    return Result(None, None)
+    return _FAILURE
 
 
 def match(text, remainder):
@@ -102,11 +117,81 @@ def match(text, remainder):
     return Result(text, remainder)
 
 
+# Returned from Formatter._format_into instead of a remainder to indicate that
+# the formatter failed
+_NO_MATCH = object()
+
+
+def _format_with_fragments(self, input):
+    """
+    An implementation of Formatter.format for formatters that implement
+    _format_into. It collects the fragments of text they produce into a list
+    and joins them together once at the end, which keeps long chains of Then
+    instances from building up their text one concatenation at a time.
+    """
+    out = []
+    remainder = self._format_into(input, out)
+    if remainder is _NO_MATCH:
+        return failure()
+    # Join with an empty string of the same type as the text so that
+    # formatters producing bytes give back bytes
+    return match(out[0][:0].join(out) if out else "", remainder)
+
+
+def _format_into_function(formatter):
+    """
+    Returns a function that takes (input, out) and acts like the specified
+    formatter's _format_into. That's just formatter._format_into when
+    formatter's format is _format_with_fragments. If format has been
+    overridden, as a subclass of one of the formatters in this module might
+    do, the function calls format instead so that the override isn't skipped.
+    Forwards get a function that looks up their _format_into on every call,
+    since it changes whenever they're set.
+    """
+    if getattr(formatter.format, "__func__", None) is not _format_with_fragments:
+        return lambda input, out: Formatter._format_into(formatter, input, out)
+    if isinstance(formatter, Forward):
+        return lambda input, out: formatter._format_into(input, out)
+    return formatter._format_into
+
+
+def _flatten(c, formatters):
+    """
+    Returns a list of the specified formatters, but with any formatters that
+    are instances of the class c (but not of one of its subclasses) replaced
+    with their own formatters. This is used by Then and First to flatten
+    nested instances of themselves.
+    """
+    result = []
+    for formatter in formatters:
+        if type(formatter) is c:
+            result.extend(formatter.formatters)
+        else:
+            result.append(formatter)
+    return result
+
+
+# Literals created by promote, keyed by the type of their text and their text.
+# Literals never change once they've been created, so all of the places in a
+# grammar that use the same string can share one. This is emptied whenever it
+# grows past _literal_cache_limit entries.
+_literal_cache = {}
+_literal_cache_limit = 1024
+
+
 def promote(value):
-    if isinstance(value, Formatter):
+    cls = value.__class__
+    if cls in _formatter_types:
         return value
-    if isinstance(value, six.string_types):
-        return Literal(value)
+    if cls is str or cls is six.text_type or (not isinstance(value, Formatter)
+            and isinstance(value, six.string_types)):
+        key = (type(value), value)
+        literal = _literal_cache.get(key)
+        if literal is None:
+            if len(_literal_cache) >= _literal_cache_limit:
+                _literal_cache.clear()
+            literal = _literal_cache[key] = Literal(value)
+        return literal
     return value
 
 
@@ -139,6 +224,8 @@ class Formatter(object):
     
     The main method that you'll want to look at is format.
     """
+    __slots__ = ()
+    
     def __repr__(self, content=''):
         return '{}({})'.format(type(self).__name__, content)
 
@@ -154,13 +241,37 @@ class Formatter(object):
         appropriate type.
         """
         raise Exception("format not implemented for " + str(type(self)))
+    
+    def _format_into(self, input, out):
+        """
+        Formats the specified input object, appending the text produced to the
+        list out instead of returning it. The remainder is returned, or
+        _NO_MATCH if this formatter failed, in which case this formatter may
+        have appended some text to out that the caller will need to remove.
+        
+        Formatter's implementation just calls format, so subclasses only need
+        to override format. Subclasses that build up their text out of a lot
+        of smaller pieces can override this instead and then use
+        _format_with_fragments as their format method.
+        """
+        result = self.format(input)
+        if not result._ok:
+            return _NO_MATCH
+        out.append(result.text)
+        return result.remainder
 
     __add__ = op_add
     __and__ = op_and
     __or__ = op_or
-    __radd__ = reversed(op_add)
-    __rand__ = reversed(op_and)
-    __ror__ = reversed(op_or)
+    
+    def __radd__(self, other):
+        return Then(promote(other), self)
+    
+    def __rand__(self, other):
+        return And(promote(other), self)
+    
+    def __ror__(self, other):
+        return First(promote(other), self)
 
 
 class Literal(Formatter):
@@ -168,14 +279,19 @@ class Literal(Formatter):
     A formatter that outputs a specified piece of literal text. It doesn't
     consume any of the input.
     """
+    __slots__ = ("text",)
+    
     def __init__(self, text):
         self.text = text
     
     def __repr__(self):
         return super(Literal, self).__repr__(repr(self.text))
 
-    def format(self, input):
-        return match(self.text, input)
+    def _format_into(self, input, out):
+        out.append(self.text)
+        return input
+    
+    format = _format_with_fragments
 
 
 class ForEach(Formatter):
@@ -189,6 +305,8 @@ class ForEach(Formatter):
     string is then returned. ForEach consumes all of the input so that the
     remainder is the empty list.
     """
+    __slots__ = ("formatter", "delimiter")
+    
     def __init__(self, formatter, delimiter=""):
         self.formatter = formatter
         self.delimiter = delimiter
@@ -199,25 +317,32 @@ class ForEach(Formatter):
             content += ', ' + repr(self.delimiter)
         return super(ForEach, self).__repr__(content)
 
-    def format(self, input):
-        if not sequence_or_dict_type.matches(input):
-            return failure()
-        results = []
+    def _format_into(self, input, out):
+        if not _sequence_or_dict_matches(input):
+            return _NO_MATCH
         if isinstance(input, dict):
-            items = input.items()
+            # Only need to iterate over the items once, so don't have Python 2
+            # build a list of them
+            items = six.iteritems(input)
         else:
             items = input
+        format_into = _format_into_function(self.formatter)
+        delimiter = self.delimiter
+        first = True
         for item in items:
-            result = self.formatter.format(item)
-            if not result:
+            if delimiter and not first:
+                out.append(delimiter)
+            first = False
+            if format_into(item, out) is _NO_MATCH:
                 # TODO: what should ForEach do when its formatter fails on a
                 # particular item? At this point I'm just having it fail out,
                 # but this needs to be thought out to see if that's really the
                 # best behavior.
-                return failure()
-            results.append(result.text)
-        return match(self.delimiter.join(results), []) # TODO: should this result in an
-        # empty list, or should it result in None instead?
+                return _NO_MATCH
+        return [] # TODO: should this result in an empty list, or should it
+        # result in None instead?
+    
+    format = _format_with_fragments
 
 
 class String(Formatter):
@@ -226,8 +351,13 @@ class String(Formatter):
     Python's str() function. This is typically the formatter that you'll use
     to format numbers and other things like that. The remainder is always None.
     """
-    def format(self, input):
-        return match(str(input), None)
+    __slots__ = ()
+    
+    def _format_into(self, input, out):
+        out.append(str(input))
+        return None
+    
+    format = _format_with_fragments
 
 
 class Repr(Formatter):
@@ -235,8 +365,13 @@ class Repr(Formatter):
     Same to String(), but this formatter uses repr() instead of str() to do the
     actual formatting.
     """
-    def format(self, input):
-        return match(repr(input), None)
+    __slots__ = ()
+    
+    def _format_into(self, input, out):
+        out.append(repr(input))
+        return None
+    
+    format = _format_with_fragments
 
 
 class _ListExtremity(Formatter):
@@ -245,24 +380,27 @@ class _ListExtremity(Formatter):
     sequence easier to work with. You shouldn't use this formatter; instead,
     use one of its four subclasses, Head, Tail, Front, and Back.
     """
+    __slots__ = ("formatter",)
+    
     def __init__(self, formatter):
         self.formatter = formatter
     
     def __repr__(self):
         return super(_ListExtremity, self).__repr__(repr(self.formatter))
 
-    def format(self, input):
-        if not sequence_type.matches(input):
-            return failure()
+    def _format_into(self, input, out):
+        if not _sequence_matches(input):
+            return _NO_MATCH
         elif len(input) < 1:
-            return failure()
+            return _NO_MATCH
         else:
             value = self._value_function(input)
             remainder = self._remainder_function(input)
-        result = self.formatter.format(value)
-        if not result:
-            return failure()
-        return match(result.text, remainder)
+        if _format_into_function(self.formatter)(value, out) is _NO_MATCH:
+            return _NO_MATCH
+        return remainder
+    
+    format = _format_with_fragments
 
 
 class Head(_ListExtremity):
@@ -280,8 +418,12 @@ class Head(_ListExtremity):
     >>> first_three.format("12345").text
     '123'
     """
+    __slots__ = ()
+    
     _value_function = lambda self, x: x[0]
     _remainder_function = lambda self, x: x[1:]
+    _from_front = True
+    _consumes = True
 
 
 class Tail(_ListExtremity):
@@ -289,8 +431,12 @@ class Tail(_ListExtremity):
     Same as Head, but this operates on and removes the last item in the list
     instead of the first item.
     """
+    __slots__ = ()
+    
     _value_function = lambda self, x: x[-1]
     _remainder_function = lambda self, x: x[:-1]
+    _from_front = False
+    _consumes = True
 
 
 class Front(_ListExtremity):
@@ -302,8 +448,12 @@ class Front(_ListExtremity):
     >>> first_three_times.format("12345").text
     '111'
     """
+    __slots__ = ()
+    
     _value_function = lambda self, x: x[0]
     _remainder_function = lambda self, x: x
+    _from_front = True
+    _consumes = False
 
 
 class Back(_ListExtremity):
@@ -311,8 +461,102 @@ class Back(_ListExtremity):
     Same as Front, but this operates on the last item in the list instead of
     the first item.
     """
+    __slots__ = ()
+    
     _value_function = lambda self, x: x[-1]
     _remainder_function = lambda self, x: x
+    _from_front = False
+    _consumes = False
+
+
+# The types that _ExtremityRun knows how to take items off of the ends of
+_extremity_types = frozenset([Head, Tail, Front, Back])
+# The types of sequences that _ExtremityRun will work with. Slicing these and
+# then indexing into the slice is guaranteed to give the same item as indexing
+# into the original sequence would.
+_run_sequence_types = frozenset([list, tuple, str, bytes, six.text_type])
+
+
+class _ExtremityRun(Formatter):
+    """
+    A formatter that Then uses in place of two or more Heads, Tails, Fronts
+    and Backs that run one after another. It keeps track of which items are
+    left as a start and stop index into the original sequence and only slices
+    it once at the end, instead of each Head or Tail slicing off a copy of
+    the whole rest of the sequence.
+    """
+    __slots__ = ("formatters",)
+    
+    def __init__(self, formatters):
+        self.formatters = formatters
+    
+    def _format_into(self, input, out):
+        if type(input) not in _run_sequence_types:
+            # Some other sort of sequence; let the formatters take care of it
+            # one at a time
+            for formatter in self.formatters:
+                input = _format_into_function(formatter)(input, out)
+                if input is _NO_MATCH:
+                    return _NO_MATCH
+            return input
+        start = 0
+        stop = len(input)
+        for formatter in self.formatters:
+            if start >= stop:
+                return _NO_MATCH
+            if formatter._from_front:
+                index = start
+            else:
+                index = stop - 1
+            if _format_into_function(formatter.formatter)(input[index], out) is _NO_MATCH:
+                return _NO_MATCH
+            if formatter._consumes:
+                if formatter._from_front:
+                    start += 1
+                else:
+                    stop -= 1
+        if start == 0 and stop == len(input):
+            return input
+        return input[start:stop]
+    
+    format = _format_with_fragments
+
+
+def _fuse_literals(formatters):
+    """
+    Returns a list of the specified formatters, but with runs of Literals
+    replaced with a single Literal whose text is all of their text put
+    together.
+    """
+    result = []
+    for formatter in formatters:
+        if type(formatter) is Literal and result and type(result[-1]) is Literal:
+            result[-1] = Literal(result[-1].text + formatter.text)
+        else:
+            result.append(formatter)
+    return result
+
+
+def _group_extremities(formatters):
+    """
+    Returns a list of the specified formatters, but with runs of two or more
+    Heads, Tails, Fronts and Backs, at least one of which is a Head or a Tail,
+    replaced with _ExtremityRun instances.
+    """
+    result = []
+    run = []
+    for formatter in tuple(formatters) + (None,):
+        if type(formatter) in _extremity_types:
+            run.append(formatter)
+            continue
+        if len(run) > 1 and any(f._consumes for f in run):
+            result.append(_ExtremityRun(tuple(run)))
+        else:
+            result.extend(run)
+        run = []
+        if formatter is not None:
+            result.append(formatter)
+    return result
 
 
 class Type(Formatter):
@@ -322,16 +566,21 @@ class Type(Formatter):
     specified static types. Each of those types can be a Python class or a
     static type as defined by parcon.static.
     """
+    __slots__ = ("static_type", "_matches")
+    
     def __init__(self, *static_types):
         self.static_type = static.Or(static_types)
+        self._matches = self.static_type.matches
 
     def __repr__(self):
         return super(Type, self).__repr__(str(self.static_type))
     
-    def format(self, input):
-        if not self.static_type.matches(input):
-            return failure()
-        return match("", input)
+    def _format_into(self, input, out):
+        if not self._matches(input):
+            return _NO_MATCH
+        return input
+    
+    format = _format_with_fragments
 
 
 class And(Formatter):
@@ -349,6 +598,8 @@ class And(Formatter):
     would be a formatter that formats ints and longs as per the String
     formatter but that fails if any other type is passed to it.
     """
+    __slots__ = ("first", "second")
+    
     def __init__(self, first, second):
         self.first = first
         self.second = second
@@ -357,11 +608,15 @@ class And(Formatter):
         return super(And, self).__repr__(
             '{}, {}'.format(self.first, self.second))
     
-    def format(self, input):
-        first_result = self.first.format(input)
-        if not first_result:
-            return failure()
-        return self.second.format(input)
+    def _format_into(self, input, out):
+        length = len(out)
+        if _format_into_function(self.first)(input, out) is _NO_MATCH:
+            return _NO_MATCH
+        # Whatever the first formatter produced is thrown away
+        del out[length:]
+        return _format_into_function(self.second)(input, out)
+    
+    format = _format_with_fragments
 
 
 class Then(Formatter):
@@ -372,22 +627,38 @@ class Then(Formatter):
     will be the remainder of the second formatter.
     
     If either formatter fails, Then also fails.
+    
+    Thens nested inside of each other, as a + b + c + d creates, have all of
+    their formatters collected into the formatters field of the outermost
+    Then so that it can run them all in a single loop.
     """
+    __slots__ = ("first", "second", "formatters", "_steps")
+    
     def __init__(self, first, second):
         self.first = first
         self.second = second
+        self.formatters = tuple(_flatten(Then, [first, second]))
+        # Each step is (text, None) for a Literal, which can just have its
+        # text added to the output without being called, or (None, function)
+        # for anything else, where function is from _format_into_function
+        self._steps = tuple([(f.text, None) if type(f) is Literal
+                             else (None, _format_into_function(f))
+                for f in _group_extremities(_fuse_literals(self.formatters))])
 
     def __repr__(self):
         return super(Then, self).__repr__('{}, {}'.format(self.first, self.second))
     
-    def format(self, input):
-        first_result = self.first.format(input)
-        if not first_result:
-            return failure()
-        second_result = self.second.format(first_result.remainder)
-        if not second_result:
-            return failure()
-        return match(first_result.text + second_result.text, second_result.remainder)
+    def _format_into(self, input, out):
+        for text, format_into in self._steps:
+            if format_into is None:
+                out.append(text)
+                continue
+            input = format_into(input, out)
+            if input is _NO_MATCH:
+                return _NO_MATCH
+        return input
+    
+    format = _format_with_fragments
 
 
 class First(Formatter):
@@ -399,20 +670,95 @@ class First(Formatter):
     may have consumed.
     
     If none of the formatters match, First fails.
-    """
+    
+    Any formatters that are themselves instances of First have their
+    formatters merged into this First's formatters. If all of the resulting
+    formatters are of the form Is(value) & "text" (or Is(value) + "text"),
+    as in (Is(True) & "true") | (Is(False) & "false"), First looks simple
+    values such as numbers, strings, booleans and None up in a dictionary
+    instead of trying each formatter in turn.
+    """
+    __slots__ = ("formatters", "_switch", "_format_intos")
+    
     def __init__(self, *formatters):
-        self.formatters = formatters
+        self.formatters = tuple(_flatten(First, formatters))
+        self._switch = _build_switch(self.formatters)
+        self._format_intos = tuple(_format_into_function(f) for f in self.formatters)
 
     def __repr__(self):
         return super(First, self).__repr__(', '.join(map(
             repr, self.formatters)))
 
-    def format(self, input):
-        for formatter in self.formatters:
-            result = formatter.format(input)
-            if result:
-                return match(result.text, result.remainder)
-        return failure()
+    def _format_into(self, input, out):
+        switch = self._switch
+        if switch is not None and input.__class__ in _switch_types:
+            text = switch.get(input, _NO_MATCH)
+            if text is _NO_MATCH:
+                return _NO_MATCH
+            out.append(text)
+            return input
+        length = len(out)
+        for format_into in self._format_intos:
+            remainder = format_into(input, out)
+            if remainder is not _NO_MATCH:
+                return remainder
+            # Throw away whatever text the formatter produced before failing
+            del out[length:]
+        return _NO_MATCH
+    
+    format = _format_with_fragments
+
+
+# Types whose instances compare equal to each other exactly when they're
+# equal according to a dictionary lookup. First only uses its dictionary of
+# values when both the values in it and the input being formatted are of one
+# of these types.
+_switch_types = frozenset(six.integer_types + six.string_types +
+                          (bool, float, bytes, six.text_type, type(None)))
+
+
+def _switch_case(formatter):
+    """
+    Returns (value, text) if the specified formatter is of the form
+    Is(value) & Literal(text) or Is(value) + Literal(text), or None if it
+    isn't.
+    """
+    if type(formatter) is And:
+        cmp, literal = formatter.first, formatter.second
+    elif type(formatter) is Then and len(formatter.formatters) == 2:
+        cmp, literal = formatter.formatters
+    else:
+        return None
+    if type(cmp) is not Is or type(literal) is not Literal:
+        return None
+    value = cmp.value
+    # NaN isn't equal to itself, but a dictionary would still find it
+    if value.__class__ not in _switch_types or value != value:
+        return None
+    return value, literal.text
+
+
+def _build_switch(formatters):
+    """
+    Returns a dictionary mapping values to the text First should produce for
+    them if all of the specified formatters are of the form that
+    _switch_case accepts, or None if they aren't. Earlier formatters take
+    precedence over later ones, just as they do when First tries them in
+    order.
+    """
+    if len(formatters) < 2:
+        return None
+    switch = {}
+    for formatter in formatters:
+        case = _switch_case(formatter)
+        if case is None:
+            return None
+        switch.setdefault(case[0], case[1])
+    return switch
+
+
+def _unset_forward(input, out):
+    raise Exception("Forward has not yet had a formatter set into it")
 
 
 class Forward(Formatter):
@@ -433,16 +779,34 @@ class Forward(Formatter):
     operators; you'll probably want to wrap the right-hand side in parentheses
     in order to avoid precedence issues that might otherwise occur.
     """
+    # _format_into is a slot instead of a method; set fills it in with the
+    # _format_into of the formatter being delegated to, so that formatting
+    # doesn't have to go through this Forward every time. Subclasses can
+    # still override _format_into with a method.
+    __slots__ = ("formatter", "_format_into")
+    
     def __init__(self, formatter=None):
-        self.formatter = formatter
+        self.formatter = None
+        if self.__class__._format_into is Forward._format_into:
+            self._format_into = _unset_forward
+        if formatter is not None:
+            self.set(formatter)
     
-    def format(self, input):
-        if self.formatter is None:
-            raise Exception("Forward has not yet had a formatter set into it")
-        return self.formatter.format(input)
+    format = _format_with_fragments
     
     def set(self, formatter):
         self.formatter = formatter
+        if self.__class__._format_into is Forward._format_into:
+            if six.get_unbound_function(self.__class__.format) is _format_with_fragments:
+                # _format_into_function takes care of formatters that
+                # override format and of other Forwards, whose formatter
+                # might not have been set yet or might change later
+                self._format_into = _format_into_function(formatter)
+            else:
+                # A subclass overriding format; this is only used if the
+                # override calls Forward.format, so don't bother binding
+                # anything
+                self._format_into = lambda input, out: _format_into_function(self.formatter)(input, out)
     
     __lshift__ = set
 
@@ -454,16 +818,20 @@ class _Cmp(Formatter):
     Subclasses must implement a _cmp method that returns a boolean with the
     result of the comparison.
     """
+    __slots__ = ("value",)
+    
     def __init__(self, value):
         self.value = value
 
     def __repr__(self):
         return super(_Cmp, self).__repr__(repr(self.value))
 
-    def format(self, input):
+    def _format_into(self, input, out):
         if self._cmp(input, self.value):
-            return match("", input)
-        return failure()
+            return input
+        return _NO_MATCH
+    
+    format = _format_with_fragments
 
 
 class Is(_Cmp):
@@ -472,6 +840,8 @@ class Is(_Cmp):
     it only succeeds if its input is equal, as per the == operator, to a value
     provided to the Is instance when it's constructed.
     """
+    __slots__ = ()
+    
     @staticmethod
     def _cmp(a, b):
         return a == b
@@ -483,6 +853,15 @@ class IsExactly(_Cmp):
     operator to perform the equality check. This should be used for True,
     False, None, and other such values.
     """
+    __slots__ = ()
+    
     @staticmethod
     def _cmp(a, b):
         return a is b
+
+
+# The formatter classes defined in this module. promote checks for these
+# before falling back to isinstance, since they're what it's usually given.
+_formatter_types = frozenset([Literal, ForEach, String, Repr, Head, Tail,
+                              Front, Back, Type, And, Then, First, Forward,
+                              Is, IsExactly])
@@ -6,6 +6,7 @@ together. Pargon is a portmanteau of Parcon and Pargen.
 import parcon
 from parcon import pargen
 from parcon import static
+import six
 
 parser_type = static.compile(parcon.Parser)
 formatter_type = static.compile(pargen.Formatter)
@@ -33,6 +34,17 @@ class ParserFormatter(parcon.Parser, pargen.Formatter):
         formatter_type.check_matches(formatter)
         self.parser = parser
         self.formatter = formatter
+        # Hand calls straight to the parser and formatter instead of going
+        # through the methods below, unless a subclass has overridden them.
+        # (Comparing the underlying functions since Python 2 creates a new
+        # unbound method every time one is looked up.)
+        if (six.get_unbound_function(type(self).parse)
+                is six.get_unbound_function(ParserFormatter.parse)):
+            self.parse = parser.parse
+        if (six.get_unbound_function(type(self).format)
+                is six.get_unbound_function(ParserFormatter.format)):
+            self.format = formatter.format
+            self._format_into = pargen._format_into_function(formatter)
     
     def parse(self, text, position, end, space):
         return self.parser.parse(text, position, end, space)
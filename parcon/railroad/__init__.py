@@ -34,6 +34,20 @@ class Component(object):
     def optimize(self):
         pass
     
+    def structural_key(self, child_key=None):
+        """
+        Returns a hashable value describing this component's structure. Two
+        components that look exactly the same when drawn will have equal
+        structural keys.
+        
+        child_key, if specified, is a function that will be called to get the
+        structural key of each of this component's children. It defaults to
+        calling structural_key on each child, but it can be passed something
+        that looks up keys that have already been computed to avoid walking
+        the whole tree below this component.
+        """
+        raise NotImplementedError
+    
     def __repr__(self):
         return self.__str__()
 
@@ -42,6 +56,9 @@ class Nothing(Component):
     def copy(self):
         return Nothing()
     
+    def structural_key(self, child_key=None):
+        return (Nothing,)
+    
     def __str__(self):
         return "Nothing()"
 
@@ -65,6 +82,10 @@ class Then(Component):
         for construct in self.constructs:
             construct.optimize()
     
+    def structural_key(self, child_key=None):
+        child_key = child_key or _structural_key
+        return (Then,) + tuple([child_key(c) for c in self.constructs])
+    
     def __str__(self):
         return "Then(%s)" % ", ".join([repr(c) for c in self.constructs])
 
@@ -88,6 +109,10 @@ class Or(Component):
         for construct in self.constructs:
             construct.optimize()
     
+    def structural_key(self, child_key=None):
+        child_key = child_key or _structural_key
+        return (Or,) + tuple([child_key(c) for c in self.constructs])
+    
     def __str__(self):
         return "Or(%s)" % ", ".join([repr(c) for c in self.constructs])
 
@@ -101,10 +126,36 @@ class Token(Component):
     def copy(self):
         return Token(self.type, self.text)
     
+    def structural_key(self, child_key=None):
+        return (Token, self.type, self.text)
+    
     def __str__(self):
         return "Token(%s, %s)" % (repr(self.type), repr(self.text))
 
 
+class TokenRun(Component):
+    """
+    A run of tokens, all of the same type, one after another. This means the
+    same thing as Then(Token(type, text1), Token(type, text2), ...), but it
+    allows the text of all of the tokens to be laid out at once. raildraw
+    creates these automatically from runs of tokens present in Then instances,
+    so there usually isn't any need to create them manually.
+    """
+    def __init__(self, type, *texts):
+        assert type >= 1 and type <= 4
+        self.type = type
+        self.texts = list(texts)
+    
+    def copy(self):
+        return TokenRun(self.type, *self.texts)
+    
+    def structural_key(self, child_key=None):
+        return (TokenRun, self.type) + tuple(self.texts)
+    
+    def __str__(self):
+        return "TokenRun(%s)" % ", ".join([repr(self.type)] + [repr(t) for t in self.texts])
+
+
 class Loop(Component):
     def __init__(self, component, delimiter):
         self.component = component
@@ -121,6 +172,10 @@ class Loop(Component):
         self.component.optimize()
         self.delimiter.optimize()
     
+    def structural_key(self, child_key=None):
+        child_key = child_key or _structural_key
+        return (Loop, child_key(self.component), child_key(self.delimiter))
+    
     def __str__(self):
         return "Loop(%s, %s)" % (repr(self.component), repr(self.delimiter))
 
@@ -129,10 +184,17 @@ class Bullet(Component):
     def copy(self):
         return Bullet()
     
+    def structural_key(self, child_key=None):
+        return (Bullet,)
+    
     def __str__(self):
         return "Bullet()"
 
 
+def _structural_key(component):
+    return component.structural_key()
+
+
 class Railroadable(object):
     """
     A class representing an object that can be drawn as a railroad diagram.
@@ -29,6 +29,7 @@ from operator import itemgetter
 from parcon import railroad as rr
 from parcon import options
 from math import radians
+import six
 try:
     import cairo
     import pango
@@ -41,6 +42,14 @@ except ImportError:
     raise
 
 
+# The angles, in radians, used by all of the arcs we draw
+_RAD_0 = radians(0)
+_RAD_90 = radians(90)
+_RAD_180 = radians(180)
+_RAD_270 = radians(270)
+_RAD_360 = radians(360)
+
+
 # We have two dicts, one that maps railroad classes (Then, Or, Token, etc.) to
 # functions that return (width, height, line_position) and one that maps
 # railroad classes to functions that draw them.
@@ -48,6 +57,17 @@ except ImportError:
 size_functions = {}
 draw_functions = {}
 
+# We also have a third dict that maps railroad classes to functions that
+# return the constructs directly contained within a construct of that class.
+# compute_all_sizes uses this to size a construct's children before the
+# construct itself. Classes not present in this dict have no children.
+
+child_functions = {
+    rr.Then: lambda construct: construct.constructs,
+    rr.Or: lambda construct: construct.constructs,
+    rr.Loop: lambda construct: [construct.component, construct.delimiter]
+}
+
 plain_font = pango.FontDescription("sans 10")
 bold_font = pango.FontDescription("sans bold 10")
 italic_font = pango.FontDescription("sans italic 10")
@@ -55,8 +75,11 @@ bold_italic_font = pango.FontDescription("sans bold italic 10")
 title_font = pango.FontDescription("sans bold 14")
 default_line_size = 2
 
-def create_options(map):
-    return options.Options(map,
+def default_options():
+    """
+    Returns a dict of the default value of every option raildraw knows about.
+    """
+    return dict(
         raildraw_production_font=plain_font,
         raildraw_text_font=bold_font,
         raildraw_anycase_font=plain_font,
@@ -73,6 +96,7 @@ def create_options(map):
         raildraw_token_padding=1,
         raildraw_token_margin=0,
         raildraw_token_rect_padding=12,
+        raildraw_token_run_length=3,
         raildraw_then_before_arrow=8,
         raildraw_then_after_arrow=0,
         raildraw_line_size=1.6,
@@ -85,10 +109,51 @@ def create_options(map):
         raildraw_loop_radius=7,
         raildraw_loop_before=6,
         raildraw_loop_after=6,
-        raildraw_scale=1.0
+        raildraw_scale=1.0,
+        raildraw_fast_antialias=True
     )
 
 
+def create_options(map):
+    """
+    Creates the options object used by all of raildraw's size and draw
+    functions from the specified dict of options, filling in defaults for
+    any options not present. The values of all of the options are copied
+    into slots of a FrozenOptions instance, which is quicker to read from
+    than options.Options.
+    """
+    result = FrozenOptions(options.Options(map, **default_options()))
+    # Sizes computed by compute_all_sizes, keyed by the id of the construct
+    # they belong to, and the diagrams they were computed for, which are kept
+    # around so that those ids can't be reused by other constructs
+    result._size_cache = {}
+    result._sized_diagrams = []
+    # Structural keys of the constructs above, also keyed by id, along with
+    # the table that interns structural keys into small ints and the sizes of
+    # each distinct structure, keyed by the interned ints. Constructs that
+    # look exactly the same share a single size computation this way.
+    result._key_cache = {}
+    result._interned_keys = {}
+    result._structural_sizes = {}
+    # The number of constructs seen with each interned structural key, and
+    # recordings of constructs whose key was seen more than once, keyed by
+    # (key, forward), made by draw_recorded
+    result._key_counts = {}
+    result._recordings = {}
+    # Pango contexts and layouts created by get_pango_layout, keyed by the id
+    # of the cairo context they belong to
+    result._pango_layouts = {}
+    # Layouts of token text created by get_token_layout, keyed by the id of
+    # the Pango context they were created with (which is kept alive by
+    # _pango_layouts), then by font, then by text
+    result._layout_cache = {}
+    # TokenMetrics created by token_metrics, keyed by (type, text)
+    result._token_metrics = {}
+    # Prebuilt arrow paths created by arrow_paths, keyed by direction
+    result._arrow_paths = {}
+    return result
+
+
 def f(map, key):
     """
     A function decorator that results in the specified function being added
@@ -101,11 +166,121 @@ def f(map, key):
 
 
 def size_of(image, construct, options):
-    return size_functions[type(construct)](image, construct, options)
+    try:
+        return options._size_cache[id(construct)]
+    except KeyError:
+        return compute_all_sizes(image, construct, options)
+
+
+def sizes_of(image, constructs, options):
+    """
+    Returns a list of the sizes of the specified constructs. This reads
+    straight from the size cache when all of them have already been sized,
+    which is always the case for the children of a construct being sized or
+    drawn by compute_all_sizes or draw_to_context.
+    """
+    cache = options._size_cache
+    try:
+        return [cache[id(c)] for c in constructs]
+    except KeyError:
+        return [size_of(image, c, options) for c in constructs]
+
+
+def compute_all_sizes(image, diagram, options):
+    """
+    Computes the size of the specified diagram and of every construct within
+    it, caching them in options so that size_of can return them without
+    computing them again. The size of the diagram itself is returned.
+    
+    Constructs are visited in post-order using an explicit stack instead of
+    recursion, so by the time a construct's size function is called, the
+    sizes of its children are already in the cache. Each construct is
+    therefore only ever sized once.
+    
+    Constructs are also sized only once per distinct structure: each
+    construct's structural key (with its children's keys interned into ints,
+    so that keys stay small no matter how deep the diagram is) is looked up
+    in a table of sizes already computed for identical constructs elsewhere.
+    """
+    cache = options._size_cache
+    key_cache = options._key_cache
+    interned_keys = options._interned_keys
+    structural_sizes = options._structural_sizes
+    key_counts = options._key_counts
+    child_key = lambda c: key_cache[id(c)]
+    options._sized_diagrams.append(diagram)
+    stack = [(diagram, False)]
+    while stack:
+        construct, children_sized = stack.pop()
+        if id(construct) in cache:
+            continue
+        if children_sized:
+            key = construct.structural_key(child_key)
+            key = interned_keys.setdefault(key, len(interned_keys))
+            size = structural_sizes.get(key)
+            if size is None:
+                size = construct.raildraw_size(image, construct, options)
+                structural_sizes[key] = size
+            key_cache[id(construct)] = key
+            key_counts[key] = key_counts.get(key, 0) + 1
+            cache[id(construct)] = size
+        else:
+            stack.append((construct, True))
+            child_function = child_functions.get(type(construct))
+            if child_function is not None:
+                stack.extend([(c, False) for c in child_function(construct)])
+    return cache[id(diagram)]
+
+
+# Types of constructs whose drawings are recorded and replayed when they occur
+# more than once. Tokens and the like are cheap enough to draw that replaying
+# them would cost more than drawing them again.
+recorded_types = (rr.Or, rr.Loop)
 
 
 def draw(image, x, y, construct, options, forward):
-    return draw_functions[type(construct)](image, x, y, construct, options, forward)
+    if type(construct) in recorded_types and hasattr(cairo, "RecordingSurface"):
+        key = options._key_cache.get(id(construct))
+        if key is not None and options._key_counts[key] > 1:
+            return draw_recorded(image, x, y, construct, key, options, forward)
+    return construct.raildraw_draw(image, x, y, construct, options, forward)
+
+
+def set_up_context(context, options):
+    """
+    Applies the settings that every context raildraw draws into should have
+    to the specified context: the line width, and if raildraw_fast_antialias
+    is True, Cairo's fast antialiasing for both lines and text. Diagrams are
+    made almost entirely of short strokes, and fast antialiasing rasterizes
+    them noticeably quicker with little visible difference.
+    """
+    context.set_line_width(options.raildraw_line_size)
+    if options.raildraw_fast_antialias:
+        context.set_antialias(cairo.ANTIALIAS_FAST)
+        font_options = cairo.FontOptions()
+        font_options.set_antialias(cairo.ANTIALIAS_FAST)
+        context.set_font_options(font_options)
+
+
+def draw_recorded(image, x, y, construct, key, options, forward):
+    """
+    Draws the specified construct, which has the specified structural key,
+    by replaying a recording of it. The first time a construct with a given
+    structural key is drawn in a given direction, it's drawn into a
+    cairo.RecordingSurface, which is then replayed for it and every
+    identical construct drawn after it.
+    """
+    surface = options._recordings.get((key, forward))
+    if surface is None:
+        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+        context = cairo.Context(surface)
+        set_up_context(context, options)
+        construct.raildraw_draw(context, 0, 0, construct, options, forward)
+        options._recordings[(key, forward)] = surface
+    image.save()
+    image.set_source_surface(surface, x, y)
+    image.paint()
+    image.restore()
 
 
 def get_font_for_token(options, token):
@@ -120,55 +295,107 @@ def get_font_for_token(options, token):
     raise ValueError
 
 
-def draw_arrow(image, x, y, options, forward):
+def arrow_paths(options, forward):
     """
-    Draws an arrow at the specified position.
+    Returns (stem, head), two cairo paths that together make up an arrow
+    pointing in the specified direction with its top-left corner at (0, 0).
+    The stem is meant to be stroked and the head filled. The paths are built
+    once per direction and cached on the options object.
     """
+    try:
+        return options._arrow_paths[forward]
+    except KeyError:
+        pass
     width, height = size_of_arrow(options)
     line_pos = height / 2
     indent = options.raildraw_arrow_indent * width
+    scratch = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
     if forward:
-        image.move_to(x, y + line_pos)
-        image.line_to(x + indent, y + line_pos)
-        image.stroke()
-        image.move_to(x, y)
-        image.line_to(x + width, y + line_pos)
-        image.line_to(x, y + height)
-        image.line_to(x + indent, y + line_pos)
+        scratch.move_to(0, line_pos)
+        scratch.line_to(indent, line_pos)
+        stem = scratch.copy_path()
+        scratch.new_path()
+        scratch.move_to(0, 0)
+        scratch.line_to(width, line_pos)
+        scratch.line_to(0, height)
+        scratch.line_to(indent, line_pos)
     else:
-        image.move_to(x + width, y + line_pos)
-        image.line_to(x + (width - indent), y + line_pos)
-        image.stroke()
-        image.move_to(x + width, y)
-        image.line_to(x, y + line_pos)
-        image.line_to(x + width, y + height)
-        image.line_to(x + (width - indent), y + line_pos)
-    image.close_path()
+        scratch.move_to(width, line_pos)
+        scratch.line_to(width - indent, line_pos)
+        stem = scratch.copy_path()
+        scratch.new_path()
+        scratch.move_to(width, 0)
+        scratch.line_to(0, line_pos)
+        scratch.line_to(width, height)
+        scratch.line_to(width - indent, line_pos)
+    scratch.close_path()
+    head = scratch.copy_path()
+    options._arrow_paths[forward] = stem, head
+    return stem, head
+
+
+def draw_arrow(image, x, y, options, forward):
+    """
+    Draws an arrow at the specified position.
+    """
+    stem, head = arrow_paths(options, forward)
+    image.save()
+    image.translate(x, y)
+    image.append_path(stem)
+    image.restore()
+    image.stroke()
+    image.save()
+    image.translate(x, y)
+    image.append_path(head)
+    image.restore()
     image.fill()
 
 
 def draw_line(image, x1, y1, x2, y2):
-    if x1 == y1 and x2 == y2: # Empty line
+    if x1 == x2 and y1 == y2: # Empty line
         return
     image.move_to(x1, y1)
     image.line_to(x2, y2)
     image.stroke()
 
 
+def add_line(image, x1, y1, x2, y2):
+    """
+    Same as draw_line, but only adds the line to the current path without
+    stroking it. This lets several lines be stroked at once with a single
+    call to image.stroke().
+    """
+    image.move_to(x1, y1)
+    image.line_to(x2, y2)
+
+
 def size_of_arrow(options):
     """
     Returns the size of an arrow, in the same format as all of the other size
     functions, namely (width, height, line_position).
+    
+    The size is cached on the options object the first time it's computed.
     """
+    try:
+        return options._arrow_size
+    except (AttributeError, KeyError):
+        pass
     width = options.raildraw_arrow_width
     height = options.raildraw_arrow_height
+    options._arrow_size = width, height
     return width, height
 
 
 @f(size_functions, rr.Nothing)
 def size_of_Nothing(image, construct, options):
+    # Every Nothing is the same size, so we only need to work it out once
+    try:
+        return options._nothing_size
+    except (AttributeError, KeyError):
+        pass
     width, height = options.raildraw_size_of_arrow(options)
-    return width, height, height / 2
+    options._nothing_size = width, height, height / 2
+    return options._nothing_size
 
 
 @f(draw_functions, rr.Nothing)
@@ -176,21 +403,29 @@ def draw_Nothing(image, x, y, construct, options, forward):
     return options.raildraw_draw_arrow(image, x, y, options, forward)
 
 
-@f(size_functions, rr.Token)
-def size_of_Token(image, construct, options):
-    pango_context = pangocairo.CairoContext(image)
-    layout = pango_context.create_layout()
-    layout.set_text(construct.text)
-    layout.set_font_description(get_font_for_token(options, construct))
-    text_width, text_height = layout.get_pixel_size()
+def text_byte_length(text):
+    """
+    Returns the length, in bytes, of the specified text once encoded as UTF-8,
+    which is the unit Pango uses for indexes into a layout's text.
+    """
+    if isinstance(text, six.text_type):
+        return len(text.encode("utf-8"))
+    return len(text)
+
+
+def size_of_token_text(options, type, text_width, text_height):
+    """
+    Returns the size of a token of the specified type whose text has the
+    specified size, in the same format as all of the other size functions.
+    """
     h_padding = options.raildraw_token_padding
     v_padding = options.raildraw_token_padding
-    if construct.type not in (rr.TEXT, rr.ANYCASE):
+    if type not in (rr.TEXT, rr.ANYCASE):
         h_padding += options.raildraw_token_rect_padding
     margin = options.raildraw_token_margin
     height = text_height + (v_padding * 2) + (margin * 2)
     width = text_width + (h_padding * 2) + (margin * 2)
-    if construct.type in (rr.TEXT, rr.ANYCASE):
+    if type in (rr.TEXT, rr.ANYCASE):
         # TEXT and ANYCASE are drawn with half-circles on either end, so we
         # need to account for the size of these circles. What we add here is
         # the diameter of these circles, which accounts for a half circle at
@@ -199,86 +434,324 @@ def size_of_Token(image, construct, options):
     return (width, height, height / 2)
 
 
-@f(draw_functions, rr.Token)
-def draw_Token(image, x, y, construct, options, forward):
+def text_position_of_token(options, type, text_height):
+    """
+    Returns the offset, relative to the top-left corner of a token of the
+    specified type, at which the token's text should be drawn.
+    """
     margin = options.raildraw_token_margin
     h_padding = options.raildraw_token_padding
     v_padding = options.raildraw_token_padding
-    if construct.type not in (rr.TEXT, rr.ANYCASE):
+    if type in (rr.TEXT, rr.ANYCASE):
+        radius = (v_padding + text_height + v_padding) / 2
+        return margin + radius + h_padding, margin + v_padding
+    h_padding += options.raildraw_token_rect_padding
+    return margin + h_padding, margin + v_padding
+
+
+def draw_token_outline(image, x, y, type, text_width, text_height, options):
+    """
+    Draws the outline of a token of the specified type, along with the short
+    lines connecting it to its neighbors, but not the token's text.
+    """
+    margin = options.raildraw_token_margin
+    h_padding = options.raildraw_token_padding
+    v_padding = options.raildraw_token_padding
+    if type not in (rr.TEXT, rr.ANYCASE):
         h_padding += options.raildraw_token_rect_padding
-    pango_context = pangocairo.CairoContext(image)
-    layout = pango_context.create_layout()
-    layout.set_text(construct.text)
-    layout.set_font_description(get_font_for_token(options, construct))
-    text_width, text_height = layout.get_pixel_size()
-    if construct.type in (rr.TEXT, rr.ANYCASE):
+    left = x + margin
+    top = y + margin
+    bottom = top + v_padding + text_height + v_padding
+    line_y = top + v_padding + (text_height / 2)
+    if type in (rr.TEXT, rr.ANYCASE):
         diameter = v_padding + text_height + v_padding
         radius = diameter / 2
-        image.move_to(x + margin + radius + h_padding, y + margin + v_padding)
-        pango_context.show_layout(layout)
-        image.move_to(x + margin + radius, y + margin)
-        image.line_to(x + margin + radius + h_padding + text_width + h_padding, y + margin)
-        image.arc(x + margin + radius + h_padding + text_width + h_padding, y + margin + radius, radius, radians(270), radians(90))
-        image.line_to(x + margin + radius, y + margin + v_padding + text_height + v_padding)
-        image.arc(x + margin + radius, y + margin + radius, radius, radians(90), radians(270))
+        right = left + radius + h_padding + text_width + h_padding
+        image.move_to(left + radius, top)
+        image.line_to(right, top)
+        image.arc(right, top + radius, radius, _RAD_270, _RAD_90)
+        image.line_to(left + radius, bottom)
+        image.arc(left + radius, top + radius, radius, _RAD_90, _RAD_270)
         image.close_path() # Shouldn't have any effect since we're already at
         # the start, but just in case
-        image.stroke()
         width = margin + radius + h_padding + text_width + h_padding + radius + margin
     else:
-        image.move_to(x + margin + h_padding, y + margin + v_padding)
-        pango_context.show_layout(layout)
-        image.move_to(x + margin, y + margin)
-        image.line_to(x + margin + h_padding + text_width + h_padding, y + margin)
-        image.line_to(x + margin + h_padding + text_width + h_padding, y + margin + v_padding + text_height + v_padding)
-        image.line_to(x + margin, y + margin + v_padding + text_height + v_padding)
+        right = left + h_padding + text_width + h_padding
+        image.move_to(left, top)
+        image.line_to(right, top)
+        image.line_to(right, bottom)
+        image.line_to(left, bottom)
         image.close_path()
-        image.stroke()
         width = margin + h_padding + text_width + h_padding + margin
-    image.move_to(x, y + margin + v_padding + (text_height / 2))
-    image.line_to(x + margin, y + margin + v_padding + (text_height / 2))
-    image.stroke()
-    image.move_to(x + width, y + margin + v_padding + (text_height / 2))
-    image.line_to(x + width - margin, y + margin + v_padding + (text_height / 2))
+    # The outline and the lines on either side of it are all stroked at once
+    image.move_to(x, line_y)
+    image.line_to(left, line_y)
+    image.move_to(x + width, line_y)
+    image.line_to(x + width - margin, line_y)
     image.stroke()
 
 
+# Sizes of text measured by measure_text, keyed by (text, font), where font is
+# the font description's string form. This is shared across renders since the
+# same tokens tend to show up in diagram after diagram; it's emptied whenever
+# it grows past _text_size_cache_limit entries.
+_text_size_cache = {}
+_text_size_cache_limit = 8192
+
+
+def get_pango_layout(image, options):
+    """
+    Returns (pango_context, layout), a Pango context for the specified cairo
+    context and a layout created from it. The same pair is returned every
+    time this is called with the same cairo context and options, so callers
+    should set the layout's text and font before using it.
+    """
+    try:
+        return options._pango_layouts[id(image)][1:]
+    except KeyError:
+        pass
+    pango_context = pangocairo.CairoContext(image)
+    layout = pango_context.create_layout()
+    # The cairo context is stored alongside so that its id can't be reused
+    options._pango_layouts[id(image)] = (image, pango_context, layout)
+    return pango_context, layout
+
+
+def measure_text(image, text, font, options):
+    """
+    Returns the size, in pixels, of the specified text when drawn in the
+    specified font, as (width, height). Results are cached, so text that has
+    already been measured doesn't need to be laid out by Pango again.
+    """
+    key = (text, font.to_string())
+    try:
+        return _text_size_cache[key]
+    except KeyError:
+        pass
+    pango_context, layout = get_pango_layout(image, options)
+    layout.set_text(text)
+    layout.set_font_description(font)
+    size = layout.get_pixel_size()
+    if len(_text_size_cache) >= _text_size_cache_limit:
+        _text_size_cache.clear()
+    _text_size_cache[key] = size
+    return size
+
+
+def get_token_layout(image, text, font, options):
+    """
+    Returns (pango_context, layout), where layout is a Pango layout of the
+    specified text in the specified font. Layouts are cached per cairo
+    context, first by font and then by text, so a token whose text appears
+    several times in a diagram is only laid out once. The layout should be
+    passed to pango_context.update_layout before being shown in case the
+    context's transformation has changed since it was created.
+    """
+    pango_context, shared_layout = get_pango_layout(image, options)
+    fonts = options._layout_cache.setdefault(id(pango_context), {})
+    layouts = fonts.setdefault(font.to_string(), {})
+    layout = layouts.get(text)
+    if layout is None:
+        layout = pango_context.create_layout()
+        layout.set_text(text)
+        layout.set_font_description(font)
+        layouts[text] = layout
+    return pango_context, layout
+
+
+class TokenMetrics(object):
+    """
+    Everything about a token's appearance that size_of_Token and draw_Token
+    both need: its font, the size of its text, its overall size (in the same
+    format returned by all of the size functions) and the position of its
+    text relative to its top-left corner.
+    """
+    __slots__ = ("font", "text_width", "text_height", "size", "text_x", "text_y")
+    
+    def __init__(self, font, text_width, text_height, size, text_x, text_y):
+        self.font = font
+        self.text_width = text_width
+        self.text_height = text_height
+        self.size = size
+        self.text_x = text_x
+        self.text_y = text_y
+
+
+def token_metrics(image, construct, options):
+    """
+    Returns a TokenMetrics for the specified token. These are cached on the
+    options object by the token's type and text, so the sizing and drawing
+    of a token (and of any other token just like it) share one computation.
+    """
+    key = (construct.type, construct.text)
+    try:
+        return options._token_metrics[key]
+    except KeyError:
+        pass
+    font = get_font_for_token(options, construct)
+    text_width, text_height = measure_text(image, construct.text, font, options)
+    size = size_of_token_text(options, construct.type, text_width, text_height)
+    text_x, text_y = text_position_of_token(options, construct.type, text_height)
+    metrics = TokenMetrics(font, text_width, text_height, size, text_x, text_y)
+    options._token_metrics[key] = metrics
+    return metrics
+
+
+@f(size_functions, rr.Token)
+def size_of_Token(image, construct, options):
+    return token_metrics(image, construct, options).size
+
+
+@f(draw_functions, rr.Token)
+def draw_Token(image, x, y, construct, options, forward):
+    metrics = token_metrics(image, construct, options)
+    pango_context, layout = get_token_layout(image, construct.text, metrics.font, options)
+    draw_token_outline(image, x, y, construct.type, metrics.text_width, metrics.text_height, options)
+    image.move_to(x + metrics.text_x, y + metrics.text_y)
+    pango_context.update_layout(layout)
+    pango_context.show_layout(layout)
+
+
+def layout_token_run(image, construct, options):
+    """
+    Lays out the text of all of the tokens in the specified TokenRun with a
+    single Pango layout. The tokens' texts are separated by spaces to keep
+    Pango from shaping across token boundaries. Returns (pango_context,
+    layout, offsets, text_widths, text_height), where offsets are the
+    horizontal positions within the layout at which each token's text starts.
+    """
+    pango_context, layout = get_pango_layout(image, options)
+    layout.set_text(" ".join(construct.texts))
+    layout.set_font_description(get_font_for_token(options, construct))
+    total_width, text_height = layout.get_pixel_size()
+    offsets = []
+    text_widths = []
+    index = 0
+    for text in construct.texts:
+        start = layout.index_to_pos(index)[0] / pango.SCALE
+        index += text_byte_length(text)
+        if index < text_byte_length(layout.get_text()):
+            stop = layout.index_to_pos(index)[0] / pango.SCALE
+        else:
+            stop = total_width
+        offsets.append(start)
+        text_widths.append(stop - start)
+        index += 1 # Skip the separating space
+    return pango_context, layout, offsets, text_widths, text_height
+
+
+@f(size_functions, rr.TokenRun)
+def size_of_TokenRun(image, construct, options):
+    pango_context, layout, offsets, text_widths, text_height = layout_token_run(image, construct, options)
+    sizes = [size_of_token_text(options, construct.type, w, text_height) for w in text_widths]
+    arrow_line_size = (options.raildraw_then_before_arrow + 
+                       options.raildraw_size_of_arrow(options)[0] + 
+                       options.raildraw_then_after_arrow)
+    width, height, line_position = sizes[0]
+    return sum([w for w, h, l in sizes]) + (len(sizes) - 1) * arrow_line_size, height, line_position
+
+
+@f(draw_functions, rr.TokenRun)
+def draw_TokenRun(image, x, y, construct, options, forward):
+    pango_context, layout, offsets, text_widths, text_height = layout_token_run(image, construct, options)
+    arrow_before = options.raildraw_then_before_arrow
+    arrow_after = options.raildraw_then_after_arrow
+    items = list(zip(offsets, text_widths))
+    if not forward:
+        items.reverse()
+        arrow_before, arrow_after = arrow_after, arrow_before
+    arrow_width, arrow_height = options.raildraw_size_of_arrow(options)
+    draw_arrow = options.raildraw_draw_arrow
+    type = construct.type
+    text_x, text_y = text_position_of_token(options, type, text_height)
+    line_y = y + size_of_token_text(options, type, 0, text_height)[2]
+    arrow_y = line_y - (arrow_height / 2)
+    last = len(items) - 1
+    current_x = x
+    for index, (offset, text_width) in enumerate(items):
+        draw_token_outline(image, current_x, y, type, text_width, text_height, options)
+        # Draw only this token's portion of the shared layout by clipping to
+        # the area its text occupies
+        image.save()
+        image.rectangle(current_x + text_x, y + text_y, text_width, text_height)
+        image.clip()
+        image.move_to(current_x + text_x - offset, y + text_y)
+        pango_context.show_layout(layout)
+        image.restore()
+        current_x += size_of_token_text(options, type, text_width, text_height)[0]
+        if index != last:
+            draw_line(image, current_x, line_y, current_x + arrow_before, line_y)
+            current_x += arrow_before
+            draw_arrow(image, current_x, arrow_y, options, forward)
+            current_x += arrow_width
+            draw_line(image, current_x, line_y, current_x + arrow_after, line_y)
+            current_x += arrow_after
+
+
 @f(size_functions, rr.Then)
 def size_of_Then(image, construct, options):
     constructs = construct.constructs
-    sizes = [size_of(image, c, options) for c in constructs]
-    before_heights = [l for w, h, l in sizes]
-    after_heights = [h - l for w, h, l in sizes]
-    max_before = max(before_heights)
-    max_after = max(after_heights)
+    sizes = sizes_of(image, constructs, options)
+    # Total up the widths and find the tallest parts above and below the line
+    # in a single pass over the sizes
+    total_width = 0
+    max_before, max_after = sizes[0][2], sizes[0][1] - sizes[0][2]
+    for w, h, l in sizes:
+        total_width += w
+        if l > max_before:
+            max_before = l
+        if h - l > max_after:
+            max_after = h - l
     arrow_line_size = (options.raildraw_then_before_arrow + 
                        options.raildraw_size_of_arrow(options)[0] + 
                        options.raildraw_then_after_arrow)
-    return sum([w for w, h, l in sizes]) + (len(sizes) - 1) * arrow_line_size, max_before + max_after, max_before
+    return total_width + (len(sizes) - 1) * arrow_line_size, max_before + max_after, max_before
 
 
 @f(draw_functions, rr.Then)
 def draw_Then(image, x, y, construct, options, forward):
     constructs = construct.constructs
+    sizes = sizes_of(image, constructs, options)
     arrow_before = options.raildraw_then_before_arrow
     arrow_after = options.raildraw_then_after_arrow
     if not forward:
-        constructs = list(reversed(constructs))
+        constructs = constructs[::-1]
+        sizes = sizes[::-1]
         arrow_before, arrow_after = arrow_after, arrow_before
     arrow_width, arrow_height = options.raildraw_size_of_arrow(options)
-    width, height, line_position = size_of_Then(image, construct, options)
+    draw_arrow = options.raildraw_draw_arrow
+    width, height, line_position = size_of(image, construct, options)
+    line_y = y + line_position
+    arrow_y = line_y - (arrow_height / 2)
+    # Work out where each construct starts in a single pass, as a running sum
+    # of the widths of the constructs and connectors before it, then draw the
+    # constructs and the connectors between them from those positions
+    gap = arrow_before + arrow_width + arrow_after
+    positions = []
     current_x = x
-    for index, c in enumerate(constructs):
-        c_width, c_height, c_line_position = size_of(image, c, options)
-        draw(image, current_x, y + (line_position - c_line_position), c, options, forward)
-        current_x += c_width
-        if index != (len(constructs) - 1):
-            draw_line(image, current_x, y + line_position, current_x + arrow_before, y + line_position)
-            current_x += arrow_before
-            options.raildraw_draw_arrow(image, current_x, y + line_position - (arrow_height / 2), options, forward)
-            current_x += arrow_width
-            draw_line(image, current_x, y + line_position, current_x + arrow_after, y + line_position)
-            current_x += arrow_after
+    for c_width, c_height, c_line_position in sizes:
+        positions.append(current_x)
+        current_x += c_width + gap
+    for c, c_x, (c_width, c_height, c_line_position) in zip(constructs, positions, sizes):
+        draw(image, c_x, y + (line_position - c_line_position), c, options, forward)
+    if len(constructs) < 2:
+        return
+    # Stroke all of the lines on either side of the arrows at once, then draw
+    # the arrows themselves
+    arrow_positions = []
+    for c_x, next_x, (c_width, c_height, c_line_position) in zip(positions, positions[1:], sizes):
+        arrow_x = c_x + c_width + arrow_before
+        # Either of these can be empty (raildraw_then_after_arrow is 0 by
+        # default), in which case there's no point adding them
+        if arrow_before:
+            add_line(image, c_x + c_width, line_y, arrow_x, line_y)
+        if arrow_after:
+            add_line(image, arrow_x + arrow_width, line_y, next_x, line_y)
+        arrow_positions.append(arrow_x)
+    if arrow_before or arrow_after:
+        image.stroke()
+    for arrow_x in arrow_positions:
+        draw_arrow(image, arrow_x, arrow_y, options, forward)
 
 
 @f(size_functions, rr.Or)
@@ -286,9 +759,13 @@ def size_of_Or(image, construct, options):
     constructs = construct.constructs
     if len(constructs) == 1:
         return size_of(image, constructs[0], options)
-    sizes = [size_of(image, c, options) for c in constructs]
-    max_width = max(sizes, key=itemgetter(0))[0]
-    total_height = sum([h for w, h, l in sizes])
+    sizes = sizes_of(image, constructs, options)
+    max_width = 0
+    total_height = 0
+    for w, h, l in sizes:
+        total_height += h
+        if w > max_width:
+            max_width = w
     arrow_width, arrow_height = options.raildraw_size_of_arrow(options)
     width = ((options.raildraw_or_radius * 4) + options.raildraw_or_before
              + max_width + options.raildraw_or_after + (arrow_width * 2))
@@ -301,61 +778,68 @@ def size_of_Or(image, construct, options):
 def draw_Or(image, x, y, construct, options, forward):
     if len(construct.constructs) == 1:
         return draw(image, x, y, construct.constructs[0], options, forward)
-    width, height, line_position = size_of_Or(image, construct, options)
+    width, height, line_position = size_of(image, construct, options)
     constructs = construct.constructs
-    sizes = [size_of(image, c, options) for c in constructs]
+    sizes = sizes_of(image, constructs, options)
     max_width = max(sizes, key=itemgetter(0))[0]
     radius = options.raildraw_or_radius
     spacing = options.raildraw_or_spacing
     arrow_width, arrow_height = options.raildraw_size_of_arrow(options)
+    draw_arrow = options.raildraw_draw_arrow
     before = options.raildraw_or_before
     after = options.raildraw_or_after
     if not forward:
         before, after = after, before
+    # The x positions of everything in each row are the same from row to row,
+    # so we only compute them once
+    left_x = x + radius * 2
+    construct_x = left_x + arrow_width + before
+    right_x = construct_x + max_width + after
+    last = len(constructs) - 1
     current_y = y
     for index, (c, (w, h, l)) in enumerate(zip(constructs, sizes)):
+        line_y = current_y + l
         draw_arrows = not isinstance(c, rr.Nothing)
         # Don't draw arrows if c is a loop and its component is not Nothing;
         # the arrows tend to appear superfluous in such a case
         if isinstance(c, rr.Loop) and not isinstance(c.component, rr.Nothing):
             draw_arrows = False
         if index != 0:
-            image.move_to(x + radius, current_y + l - radius)
-            image.arc_negative(x + radius * 2, current_y + l - radius, radius, radians(180), radians(90))
+            image.move_to(x + radius, line_y - radius)
+            image.arc_negative(left_x, line_y - radius, radius, _RAD_180, _RAD_90)
             image.stroke()
         if not draw_arrows:
-            draw_line(image, x + radius * 2, current_y + l, x + radius * 2 + arrow_width, current_y + l)
+            draw_line(image, left_x, line_y, left_x + arrow_width, line_y)
         else:
-            options.raildraw_draw_arrow(image, x + radius * 2, current_y + l - (arrow_height / 2), options, forward)
-        draw_line(image, x + radius * 2 + arrow_width, current_y + l, x + radius * 2 + arrow_width + before, current_y + l)
-        construct_x = x + radius * 2 + arrow_width + before
+            draw_arrow(image, left_x, line_y - (arrow_height / 2), options, forward)
+        draw_line(image, left_x + arrow_width, line_y, construct_x, line_y)
         if isinstance(c, rr.Nothing):
-            draw_line(image, construct_x, current_y + l, construct_x + max_width / 2 - w / 2, current_y + l)
+            draw_line(image, construct_x, line_y, construct_x + max_width / 2 - w / 2, line_y)
             draw(image, construct_x + max_width / 2 - w / 2, current_y, c, options, forward)
-            draw_line(image, construct_x + max_width / 2 + w / 2, current_y + l, construct_x + max_width + after, current_y + l)
+            draw_line(image, construct_x + max_width / 2 + w / 2, line_y, right_x, line_y)
         else:
             draw(image, construct_x, current_y, c, options, forward)
-            draw_line(image, construct_x + w, current_y + l, construct_x + max_width + after, current_y + l)
+            draw_line(image, construct_x + w, line_y, right_x, line_y)
         if not draw_arrows:
-            draw_line(image, construct_x + max_width + after, current_y + l, construct_x + max_width + after + arrow_width, current_y + l)
+            draw_line(image, right_x, line_y, right_x + arrow_width, line_y)
         else:
-            options.raildraw_draw_arrow(image, construct_x + max_width + after, current_y + l - (arrow_height / 2), options, forward)
+            draw_arrow(image, right_x, line_y - (arrow_height / 2), options, forward)
         if index != 0:
-            image.move_to(construct_x + max_width + after + arrow_width, current_y + l)
-            image.arc_negative(construct_x + max_width + after + arrow_width, current_y + l - radius, radius, radians(90), radians(0))
+            image.move_to(right_x + arrow_width, line_y)
+            image.arc_negative(right_x + arrow_width, line_y - radius, radius, _RAD_90, _RAD_0)
             image.stroke()
-        if index == len(constructs) - 1: # Last construct
-            line_end_y = current_y + l - radius
+        if index == last: # Last construct
+            line_end_y = line_y - radius
         current_y += spacing + h
     image.move_to(x, y + line_position)
-    image.arc(x, y + line_position + radius, radius, radians(270), radians(0))
+    image.arc(x, y + line_position + radius, radius, _RAD_270, _RAD_0)
     image.line_to(x + radius, line_end_y)
     image.stroke()
     draw_line(image, x, y + line_position, x + radius * 2, y + line_position)
     end_x = x + radius * 2 + arrow_width + before + max_width + after + arrow_width 
     draw_line(image, end_x, y + line_position, end_x + radius * 2, y + line_position)
     image.move_to(x + width, y + line_position)
-    image.arc_negative(x + width, y + line_position + radius, radius, radians(270), radians(180))
+    image.arc_negative(x + width, y + line_position + radius, radius, _RAD_270, _RAD_180)
     image.line_to(x + width - radius, line_end_y)
     image.stroke()
 
@@ -393,7 +877,7 @@ def draw_Loop(image, x, y, construct, options, forward):
     after = options.raildraw_loop_after
     arrow_width, arrow_height = options.raildraw_size_of_arrow(options)
     d_y = y + c_height + spacing
-    width, height, line_pos = size_of_Loop(image, construct, options)
+    width, height, line_pos = size_of(image, construct, options)
     max_width = max(c_width, d_width)
     center_x = x + radius * 2 + arrow_width + before + (max_width / 2)
     draw_line(image, x, y + line_pos, x + radius * 2, y + line_pos)
@@ -406,9 +890,9 @@ def draw_Loop(image, x, y, construct, options, forward):
     # Component and its two arrows and line drawn. Now draw the curve down and
     # the delimiter, and its arrows and lines.
     image.move_to(x + radius * 2, y + line_pos)
-    image.arc_negative(x + radius * 2, y + line_pos + radius, radius, radians(270), radians(180))
+    image.arc_negative(x + radius * 2, y + line_pos + radius, radius, _RAD_270, _RAD_180)
     image.line_to(x + radius, d_y + d_line_pos - radius)
-    image.arc_negative(x + radius * 2, d_y + d_line_pos - radius, radius, radians(180), radians(90))
+    image.arc_negative(x + radius * 2, d_y + d_line_pos - radius, radius, _RAD_180, _RAD_90)
     image.stroke()
     draw_arrow_or_line(image, x + radius * 2, d_y + d_line_pos - arrow_height / 2, arrow_width, arrow_height, options, not forward, d_arrow)
     draw_line(image, x + radius * 2 + arrow_width, d_y + d_line_pos, center_x - d_width / 2, d_y + d_line_pos)
@@ -416,9 +900,9 @@ def draw_Loop(image, x, y, construct, options, forward):
     draw_line(image, center_x + d_width / 2, d_y + d_line_pos, x + width - radius * 2 - arrow_width, d_y + d_line_pos)
     draw_arrow_or_line(image, x + width - radius * 2 - arrow_width, d_y + d_line_pos - arrow_height / 2, arrow_width, arrow_height, options, not forward, d_arrow)
     image.move_to(x + width - radius * 2, d_y + d_line_pos)
-    image.arc_negative(x + width - radius * 2, d_y + d_line_pos - radius, radius, radians(90), radians(0))
+    image.arc_negative(x + width - radius * 2, d_y + d_line_pos - radius, radius, _RAD_90, _RAD_0)
     image.line_to(x + width - radius, y + line_pos + radius)
-    image.arc_negative(x + width - radius * 2, y + line_pos + radius, radius, radians(0), radians(270))
+    image.arc_negative(x + width - radius * 2, y + line_pos + radius, radius, _RAD_0, _RAD_270)
     image.stroke()
 
 
@@ -443,16 +927,63 @@ def size_of_Bullet(image, construct, options):
 def draw_Bullet(image, x, y, construct, options, forward):
     radius = options.raildraw_bullet_radius
     image.move_to(x + radius * 2, y + radius)
-    image.arc(x + radius, y + radius, radius, radians(0), radians(360))
+    image.arc(x + radius, y + radius, radius, _RAD_0, _RAD_360)
     image.stroke()
 
 
 del f
 
 
-def draw_text(context, x, y, font, text):
-    pango_context = pangocairo.CairoContext(context)
-    layout = pango_context.create_layout()
+def install_functions():
+    """
+    Attaches each function in size_functions and draw_functions to the class
+    it's for, as raildraw_size and raildraw_draw, so that size_of and draw can
+    find them with a plain attribute lookup on the construct instead of
+    looking its type up in a dict. This is called when raildraw is imported;
+    call it again after adding any functions to those dicts.
+    """
+    for c, function in size_functions.items():
+        c.raildraw_size = staticmethod(function)
+    for c, function in draw_functions.items():
+        c.raildraw_draw = staticmethod(function)
+
+install_functions()
+
+
+class FrozenOptions(object):
+    """
+    A snapshot of an options.Options instance. Each of raildraw's own options
+    is stored in a slot, so reading them is a plain attribute lookup instead
+    of a call to Options.__getattr__. Any other options present, such as
+    ones used by custom arrow functions, can still be read as attributes;
+    they're just looked up a bit more slowly.
+    """
+    __slots__ = tuple(sorted(default_options())) + ("values", "_size_cache",
+            "_sized_diagrams", "_key_cache", "_interned_keys",
+            "_structural_sizes", "_pango_layouts", "_arrow_size",
+            "_nothing_size", "_layout_cache", "_key_counts", "_recordings",
+            "_arrow_paths", "_token_metrics")
+    
+    def __init__(self, options):
+        self.values = options.values
+        for name in default_options():
+            setattr(self, name, options.values[name])
+    
+    def __getattr__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    __getitem__ = __getattr__
+
+
+def draw_text(context, x, y, font, text, options=None):
+    if options is None:
+        pango_context = pangocairo.CairoContext(context)
+        layout = pango_context.create_layout()
+    else:
+        pango_context, layout = get_pango_layout(context, options)
     layout.set_text(text)
     layout.set_font_description(font)
     context.move_to(x, y)
@@ -484,40 +1015,85 @@ def draw_to_surface(surface_cb, diagram, options, filename, forward=True):
     options = create_options(options)
     before_title = options.raildraw_title_before
     after_title = options.raildraw_title_after
+    # Copy and optimize each diagram once, up front, so that the diagrams we
+    # measure are the ones we'll actually end up drawing
+    diagram = diagram.__class__([(name, prepare_diagram(d, options))
+                                 for name, d in diagram.items()])
     # Create an empty image to give size_of something to reference
     empty_image = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
     empty_context = cairo.Context(empty_image)
     width, height = 0, 0
     for name, d in diagram.items():
-        w, h, l = size_of(empty_context, d, options)
+        w, h, l = compute_all_sizes(empty_context, d, options)
         width, height = max(width, w), h + height
     height += len(diagram) * (before_title + after_title)
     image = surface_cb(int((width + 16) * options.raildraw_scale),
                        int((height + 16) * options.raildraw_scale))
     context = cairo.Context(image)
+    set_up_context(context, options)
     if options.raildraw_scale != 1:
         context.scale(options.raildraw_scale, options.raildraw_scale)
     x = 8
     y = 8
     for name, d in diagram.items():
         if not options.raildraw_title_hide:
-            draw_text(context, x, y, options.raildraw_title_font, name + ":")
+            draw_text(context, x, y, options.raildraw_title_font, name + ":", options)
         y += after_title
-        draw_to_context(context, d, options, filename, forward, x, y)
-        # FIXME: store the size as computed 10 or 20 lines above to avoid
-        # having to compute it twice
+        draw_to_context(context, d, options, filename, forward, x, y,
+                        already_optimized=True)
         y += size_of(context, d, options)[1]
         y += before_title
 
+# Pixel buffers that draw_to_png has finished with, keyed by their size in
+# bytes, which is always a power of two. draw_to_png takes buffers from here
+# instead of allocating a new one for every image when drawing lots of them.
+_buffer_pool = {}
+_buffer_pool_limit = 4
+
+
+def get_pooled_buffer(length):
+    """
+    Returns a bytearray of at least the specified length, taken from the
+    buffer pool if one of the right size is available. Its contents are
+    whatever the last image drawn into it left behind.
+    """
+    bucket = 1
+    while bucket < length:
+        bucket *= 2
+    free = _buffer_pool.get(bucket)
+    if free:
+        return free.pop()
+    return bytearray(bucket)
+
+
+def release_pooled_buffer(buffer):
+    """
+    Returns a buffer obtained from get_pooled_buffer to the pool.
+    """
+    free = _buffer_pool.setdefault(len(buffer), [])
+    if len(free) < _buffer_pool_limit:
+        free.append(buffer)
+
+
 def draw_to_png(diagram, options, filename, forward):
     image_ref = [0]
+    buffer_ref = [0]
     def get_surface_cb(image_ref):
         def get_surface(width,height):
-            image_ref[0] = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width)
+            buffer_ref[0] = get_pooled_buffer(stride * height)
+            image_ref[0] = cairo.ImageSurface.create_for_data(buffer_ref[0],
+                    cairo.FORMAT_ARGB32, width, height, stride)
+            # The buffer might have been used before, so clear it out
+            context = cairo.Context(image_ref[0])
+            context.set_operator(cairo.OPERATOR_CLEAR)
+            context.paint()
             return image_ref[0]
         return get_surface
     draw_to_surface(get_surface_cb(image_ref), diagram, options, filename, forward)
     image_ref[0].write_to_png(filename)
+    image_ref[0].finish()
+    release_pooled_buffer(buffer_ref[0])
 
 def draw_to_svg(diagram, options, filename, forward):
     def get_surface(width, height):
@@ -532,16 +1108,70 @@ def draw_to_image(img_type, diagram, options, filename, forward=True):
     else:
         raise Exception("No such image type")
 
-def draw_to_context(context, diagram, options, filename, forward=True, x=8, y=8):
+def fuse_token_runs(diagram, options):
+    """
+    Replaces each run of raildraw_token_run_length or more consecutive tokens
+    of the same type present in any of the specified diagram's Then instances
+    with a single TokenRun, which allows the text of the entire run to be laid
+    out at once. The diagram is modified in place. If
+    raildraw_token_run_length is None, the diagram is left alone.
+    """
+    run_length = options.raildraw_token_run_length
+    if run_length is None:
+        return
+    stack = [diagram]
+    while stack:
+        construct = stack.pop()
+        if isinstance(construct, rr.Then):
+            # Group the Then's constructs into runs of same-typed tokens
+            runs = []
+            for c in construct.constructs:
+                if (isinstance(c, rr.Token) and runs and isinstance(runs[-1][0], rr.Token)
+                        and runs[-1][0].type == c.type):
+                    runs[-1].append(c)
+                else:
+                    runs.append([c])
+            construct.constructs = []
+            for run in runs:
+                if isinstance(run[0], rr.Token) and len(run) >= run_length:
+                    construct.constructs.append(rr.TokenRun(run[0].type, *[t.text for t in run]))
+                else:
+                    construct.constructs.extend(run)
+            stack.extend(construct.constructs)
+        elif isinstance(construct, rr.Or):
+            stack.extend(construct.constructs)
+        elif isinstance(construct, rr.Loop):
+            stack.extend([construct.component, construct.delimiter])
+
+
+def prepare_diagram(diagram, options):
+    """
+    Returns an optimized copy of the specified diagram, with runs of tokens
+    fused together, ready to be sized and drawn. The diagram passed in is not
+    modified.
+    """
+    diagram = diagram.copy()
+    diagram.optimize()
+    fuse_token_runs(diagram, options)
+    return diagram
+
+
+def draw_to_context(context, diagram, options, filename, forward=True, x=8, y=8,
+                    already_optimized=False):
     """
     Same as draw_to_png, but draws the specified railroad diagram to a context,
     which should be an instance of cairo.Context, instead of to a PNG file.
     draw_to_png actually delegates to this function to do the actual drawing.
     
     x and y are the position at which to draw the specified diagram.
+    
+    If already_optimized is True, the diagram is assumed to have already been
+    passed through prepare_diagram (as draw_to_surface does) and is drawn
+    as-is instead of being copied and optimized again.
     """
-    diagram = diagram.copy()
-    diagram.optimize()
+    if not already_optimized:
+        diagram = prepare_diagram(diagram, options)
+    compute_all_sizes(context, diagram, options)
     context.set_line_width(options.raildraw_line_size)
     draw(context, x, y, diagram, options, forward)
     
@@ -8,6 +8,9 @@ from parcon import railroad as rr
 import parcon as p
 
 regex_parser = None
+# The whitespace parser passed to regex_parser; like regex_parser, this can't
+# be created until parcon has finished being imported, so init_parser does it
+_no_whitespace = None
 
 def _convert_repetition(construct, flag):
     if flag is None:
@@ -21,14 +24,36 @@ def _convert_repetition(construct, flag):
     raise ValueError
 
 
+# Escape sequences that stand for a character other than the one escaped
+_escapes = {"\\n": "\n", "\\r": "\r", "\\t": "\t"}
+
+
 def _translate_backslash(char):
-    if char == "\\n":
-        return "\n"
-    if char == "\\r":
-        return "\r"
-    if char == "\\t":
-        return "\t"
-    return char
+    return _escapes.get(char, char)
+
+
+# Tuples of the tokens that character class ranges expand to, keyed by the
+# range's first and last characters. Tokens aren't modified once they've been
+# created, so the same ones can be used every time a range such as a-z shows
+# up; each use still gets its own Or, though, since those are sometimes
+# modified in place.
+_range_cache = {}
+
+
+# A token for each ASCII character, which most ranges can just be sliced out of
+_ascii_tokens = tuple([rr.Token(rr.TEXT, chr(c)) for c in range(128)])
+
+
+def _expand_range(first, last):
+    tokens = _range_cache.get((first, last))
+    if tokens is None:
+        start, stop = ord(first), ord(last) + 1
+        if stop <= 128:
+            tokens = _ascii_tokens[start:stop]
+        else:
+            tokens = tuple([rr.Token(rr.TEXT, chr(c)) for c in range(start, stop)])
+        _range_cache[(first, last)] = tokens
+    return rr.Or(*tokens)
 
 
 def init_parser():
@@ -40,10 +65,12 @@ def init_parser():
     global char_class_range
     global char_class_char
     global alternative
+    global _no_whitespace
+    _no_whitespace = p.Invalid()
     expr = p.Forward()
     char_class_char = (p.AnyChar() - p.CharIn("^]"))[lambda x: rr.Token(rr.TEXT, x)]
     char_class_range = ((p.AnyChar() - p.CharIn("^-]")) + "-" + (p.AnyChar() - "-]"))[
-        lambda x: rr.Or(*[rr.Token(rr.TEXT, chr(c)) for c in range(ord(x[0]), ord(x[1])+1)])]
+        lambda x: _expand_range(x[0], x[1])]
     char_class = ("[" + +(char_class_range | char_class_char) + "]")[
         lambda x: rr.Or(*x) if len(x) != 1 else x[0]]
     char = (p.AnyChar() - p.CharIn("[]().|\\"))
@@ -66,10 +93,22 @@ def convert_regex(regex):
     subclasses of parcon.railroad.Component. If the specified regex contains
     constructs that this module does not understand, None will be returned.
     """
+    global convert_regex
     if regex_parser is None:
         init_parser()
+    # The parser's been built now, so replace this function with one that
+    # doesn't need to check for it every time it's called
+    convert_regex = _convert_regex
+    return _convert_regex(regex)
+
+
+def _convert_regex(regex):
+    """
+    Same as convert_regex, but this assumes that init_parser has already been
+    called.
+    """
     try:
-        return regex_parser.parse_string(regex, whitespace=p.Invalid())
+        return regex_parser.parse_string(regex, whitespace=_no_whitespace)
     except p.ParseException:
         return None
 
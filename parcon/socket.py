@@ -5,6 +5,11 @@ sockets or files.
 """
 
 class LazyString(object):
+    # The least amount of data to ask more_function for at a time. Reads
+    # also get bigger as the buffer grows, so the number of calls made to
+    # more_function only grows logarithmically with the length of the data.
+    minimum_read = 4096
+    
     def __init__(self, more_function):
         self.more = more_function
         self.buffer = ""
@@ -18,8 +23,30 @@ class LazyString(object):
         else:
             limit = item + 1
         self.get_more(limit)
+        if isinstance(self.buffer, bytearray):
+            # Indexing a bytearray gives an int, so slice it instead to get a
+            # string of length 1 like indexing a string would
+            if not isinstance(item, slice):
+                item = slice(item, item + 1 or None)
+            return bytes(self.buffer[item])
         return self.buffer[item]
     
     def get_more(self, limit):
-        while len(self.buffer) < limit:
-            self.buffer += self.more(limit - len(self.buffer)) 
+        length = len(self.buffer)
+        if length >= limit:
+            return
+        chunks = []
+        while length < limit:
+            chunk = self.more(max(limit - length, self.minimum_read, length))
+            chunks.append(chunk)
+            length += len(chunk)
+        if isinstance(self.buffer, bytearray) or isinstance(chunks[0], bytes):
+            # Binary data (which includes all data on Python 2) gets appended
+            # to a bytearray in place, so reading a long stream doesn't end up
+            # copying the whole buffer each time more data is read
+            if not isinstance(self.buffer, bytearray):
+                self.buffer = bytearray(self.buffer) if self.buffer else bytearray()
+            for chunk in chunks:
+                self.buffer.extend(chunk)
+        else:
+            self.buffer += "".join(chunks)
@@ -37,6 +37,149 @@ the time it takes to look up the set of optimizations to be applied to a
 particular compiler production.
 """
 
+import six
+from six import text_type as _text_type
+from six.moves import map as _map
+import weakref
+try:
+    from collections.abc import Iterable as _IterableABC, Sized as _SizedABC
+except ImportError: # Python 2
+    from collections import Iterable as _IterableABC, Sized as _SizedABC
+
+
+def _is_iterable(value):
+    """
+    Returns True if iter(value) would succeed. Nearly all iterable objects
+    are instances of collections.abc.Iterable, which is a much quicker thing
+    to check than whether iter raises an exception; only objects that are
+    iterable solely by way of __getitem__ need to actually be passed to iter.
+    """
+    if isinstance(value, _IterableABC):
+        return True
+    try:
+        iter(value)
+        return True
+    except TypeError:
+        return False
+
+
+def _is_sized(value):
+    """
+    Returns True if len(value) would succeed, checking against
+    collections.abc.Sized first for the same reason as _is_iterable.
+    """
+    if isinstance(value, _SizedABC):
+        return True
+    try:
+        len(value)
+        return True
+    except TypeError:
+        return False
+
+
+# A value that Field passes to getattr as a default, so that it can tell when
+# an attribute is missing without having to catch an AttributeError
+_MISSING = object()
+
+
+def _flatten(c, constructs):
+    """
+    Returns a list of the specified constructs, but with any constructs that
+    are instances of the class c (but not of one of its subclasses) replaced
+    with their own constructs. This is used by Or and And to flatten nested
+    instances of themselves.
+    """
+    result = []
+    for construct in constructs:
+        if type(construct) is c:
+            result.extend(construct.constructs)
+        else:
+            result.append(construct)
+    return result
+
+
+# String types along with the type of the items that iterating over them
+# gives: text gives more text, while bytes gives ints on Python 3 and
+# single-character strs on Python 2.
+_string_item_types = ((_text_type, _text_type), (bytes, type(b"x"[0])))
+
+
+def _strings_rejected_by(item_type):
+    """
+    Returns a tuple of the string types whose items can't possibly be
+    instances of item_type (a type or a tuple of types). All uses this to
+    reject a non-empty string without iterating over the whole thing.
+    """
+    return tuple([s for s, i in _string_item_types if not issubclass(i, item_type)])
+
+
+def _any_matches(constructs):
+    """
+    Returns a function that checks whether any of the specified static types
+    match a value. Static types never change once they've been created, so
+    their matches functions are looked up once here instead of every time a
+    value is checked; a tree of Or, And and Not instances thus boils down to
+    a tree of plain closures calling each other directly.
+    """
+    matchers = tuple([_matcher(c) for c in constructs])
+    def matches(value):
+        for m in matchers:
+            if m(value):
+                return True
+        return False
+    return matches
+
+
+def _all_match(constructs):
+    """
+    Like _any_matches, but the function it returns checks whether all of the
+    specified static types match a value.
+    """
+    matchers = tuple([_matcher(c) for c in constructs])
+    def matches(value):
+        for m in matchers:
+            if not m(value):
+                return False
+        return True
+    return matches
+
+
+def _matcher(static_type):
+    """
+    Returns the quickest function to call to check a value against the
+    specified static type: the closure in its _match slot if it has one (see
+    StaticType._bind_match), or its matches method otherwise.
+    """
+    try:
+        return static_type._match
+    except AttributeError:
+        return static_type.matches
+
+
+def _uses_matches_of(static_type, cls):
+    """
+    Returns True if the specified static type's class hasn't overridden cls's
+    matches method. (The underlying functions are compared since Python 2
+    creates a new unbound method every time one is looked up.)
+    """
+    return (six.get_unbound_function(type(static_type).matches)
+            is six.get_unbound_function(cls.matches))
+
+
+def _isinstance_type(static_type):
+    """
+    If the specified static type matches exactly the values for which
+    isinstance(value, t) is true for some t, returns t. Otherwise, returns
+    None. This lets All and Any check their items with isinstance directly
+    instead of calling their component type's matches method for each one.
+    """
+    if type(static_type) is Type:
+        return static_type.type
+    if type(static_type) is Or:
+        return static_type._type_tuple
+    return None
+
+
 class StaticTypeError(Exception):
     """
     An exception thrown when an object passed to check_matches does not match
@@ -70,6 +213,21 @@ class StaticType(object):
     StaticType cannot itself be instantiated; you can only construct instances
     of subclasses of StaticType.
     """
+    # _str is where static types made up of other static types cache their
+    # string representations; static types never change once they've been
+    # created, so these only need to be built once.
+    __slots__ = ("_str", "__weakref__")
+    
+    def _key(self):
+        """
+        Returns a tuple of the fields that determine what this static type
+        matches, or None if this static type shouldn't be interned. compile
+        uses this to find static types it can share; see _intern_key.
+        StaticType's implementation returns None, so subclasses defined
+        outside of this module are never interned unless they override this.
+        """
+        return None
+    
     def matches(self, value):
         """
         Checks to see if the specified object matches this static type. If it
@@ -80,12 +238,41 @@ class StaticType(object):
         raise InternalError("StaticType subclass " + str(type(self)) + 
                 " doesn't implement the matches function")
     
+    def _bind_match(self):
+        """
+        Static types in this module that have a _match slot override this to
+        fill it in with a closure that does the same thing as their matches
+        method, but without looking anything up on self. _matcher hands these
+        out to the places that check lots of values, such as Or and And. A
+        subclass that overrides matches doesn't get a closure, so that its
+        matches still gets called.
+        """
+        pass
+    
+    def __getstate__(self):
+        # The closure in _match can't be pickled, so leave it out and have
+        # __setstate__ build it again
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            if isinstance(slots, six.string_types):
+                slots = (slots,)
+            for name in slots:
+                if name not in ("_match", "__weakref__", "__dict__") and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._bind_match()
+    
     def check_matches(self, value):
         """
         Calls self.matches(value). If the reslt is false, a StaticTypeError is
         raised. If the result is true, this method simply returns.
         """
-        if not self.matches(value):
+        if not _matcher(self)(value):
             raise StaticTypeError("Value " + str(value) + " is not of type " + 
             str(self));
     
@@ -102,12 +289,25 @@ class Type(StaticType):
     
     The type is stored in a field named type.
     """
+    # _match is filled in with a closure over the type, which skips looking
+    # up self.type every time a value is matched; see _bind_match
+    __slots__ = ("type", "_match")
+    
     def __init__(self, type):
         self.type = type
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, Type):
+            type = self.type
+            self._match = lambda value: isinstance(value, type)
     
     def matches(self, value):
         return isinstance(value, self.type)
     
+    def _key(self):
+        return (self.type,)
+    
     def __str__(self):
         return "Type(" + str(self.type) + ")"
 
@@ -116,27 +316,67 @@ class Or(StaticType):
     """
     A static type that matches a value if any of its constructs match that
     particular value. The constructs are stored in a field named constructs.
+    
+    Any constructs that are themselves instances of Or have their constructs
+    merged into this Or's constructs. If all of the resulting constructs are
+    instances of Type, this Or matches values with a single call to
+    isinstance, passing it a tuple of all of their types.
     """
+    # See Type for what _match is for
+    __slots__ = ("constructs", "_type_tuple", "_match")
+    
     def __init__(self, *constructs):
-        self.constructs = [compile(c) for c in constructs]
+        self.constructs = _flatten(Or, [compile(c) for c in constructs])
+        if all(type(c) is Type for c in self.constructs):
+            self._type_tuple = tuple(c.type for c in self.constructs)
+        else:
+            self._type_tuple = None
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, Or):
+            type_tuple = self._type_tuple
+            if type_tuple is not None:
+                self._match = lambda value: isinstance(value, type_tuple)
+            else:
+                self._match = _any_matches(self.constructs)
     
     def matches(self, value):
+        if self._type_tuple is not None:
+            return isinstance(value, self._type_tuple)
         for c in self.constructs:
             if c.matches(value):
                 return True
         return False
     
+    def _key(self):
+        return tuple(self.constructs)
+    
     def __str__(self):
-        return "Or(" + ", ".join(str(c) for c in self.constructs) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "Or(" + ", ".join(str(c) for c in self.constructs) + ")"
+            return self._str
 
 
 class And(StaticType):
     """
     A static type that matches a value if all of its constructs match that
     particular value. The constructs are stored in a field named constructs.
+    Any constructs that are themselves instances of And have their constructs
+    merged into this And's constructs.
     """
+    # See Type for what _match is for
+    __slots__ = ("constructs", "_match")
+    
     def __init__(self, *constructs):
-        self.constructs = [compile(c) for c in constructs]
+        self.constructs = _flatten(And, [compile(c) for c in constructs])
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, And):
+            self._match = _all_match(self.constructs)
     
     def matches(self, value):
         for c in self.constructs:
@@ -144,8 +384,15 @@ class And(StaticType):
                 return False
         return True
     
+    def _key(self):
+        return tuple(self.constructs)
+    
     def __str__(self):
-        return "And(" + ", ".join(str(c) for c in self.constructs) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "And(" + ", ".join(str(c) for c in self.constructs) + ")"
+            return self._str
 
 
 class Not(StaticType):
@@ -154,14 +401,30 @@ class Not(StaticType):
     the construct with which this Not instance was created. The construct is
     stored in a field named construct.
     """
+    # See Type for what _match is for
+    __slots__ = ("construct", "_match")
+    
     def __init__(self, construct):
         self.construct = compile(construct);
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, Not):
+            construct_match = _matcher(self.construct)
+            self._match = lambda value: not construct_match(value)
     
     def matches(self, value):
         return not self.construct.matches(value)
     
+    def _key(self):
+        return (self.construct,)
+    
     def __str__(self):
-        return "Not(" + str(self.construct) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "Not(" + str(self.construct) + ")"
+            return self._str
 
 
 class All(StaticType):
@@ -170,21 +433,44 @@ class All(StaticType):
     and all of its values match the component type with which this All
     instance was created. The type is stored in a field named component_type.
     """
+    __slots__ = ("component_type", "_item_type", "_rejected_strings")
+    
     def __init__(self, component_type):
         self.component_type = compile(component_type)
+        self._item_type = _isinstance_type(self.component_type)
+        if self._item_type is not None:
+            self._rejected_strings = _strings_rejected_by(self._item_type)
+        else:
+            self._rejected_strings = ()
     
     def matches(self, value):
-        try:
-            iterator = iter(value)
-        except TypeError: # Not an iterable type
+        if not _is_iterable(value):
             return False
-        for item in iterator:
-            if not self.component_type.matches(item):
-                return False
-        return True
+        item_type = self._item_type
+        if item_type is not None:
+            rejected_strings = self._rejected_strings
+            if rejected_strings and isinstance(value, rejected_strings):
+                # Only the empty string can match
+                return not value
+            if type(value) in (list, tuple):
+                # Lists and tuples usually only hold a handful of distinct
+                # types, so check those instead of every item. isinstance
+                # also looks at __class__, which can differ from type(item),
+                # so fall back to checking every item if a type doesn't pass.
+                if all(issubclass(t, item_type) for t in set(_map(type, value))):
+                    return True
+            return all(isinstance(item, item_type) for item in value)
+        return all(_map(self.component_type.matches, value))
+    
+    def _key(self):
+        return (self.component_type,)
     
     def __str__(self):
-        return "All(" + str(self.component_type) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "All(" + str(self.component_type) + ")"
+            return self._str
 
 
 class Any(StaticType):
@@ -193,21 +479,29 @@ class Any(StaticType):
     and any of its values match the component type with which this All
     instance was created. The type is stored in a field named component_type.
     """
+    __slots__ = ("component_type", "_item_type")
+    
     def __init__(self, component_type):
         self.component_type = compile(component_type)
+        self._item_type = _isinstance_type(self.component_type)
     
     def matches(self, value):
-        try:
-            iterator = iter(value)
-        except TypeError: # Not an iterable type
+        if not _is_iterable(value):
             return False
-        for item in iterator:
-            if self.component_type.matches(item):
-                return True
-        return False
+        item_type = self._item_type
+        if item_type is not None:
+            return any(isinstance(item, item_type) for item in value)
+        return any(_map(self.component_type.matches, value))
+    
+    def _key(self):
+        return (self.component_type,)
     
     def __str__(self):
-        return "Any(" + str(self.component_type) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "Any(" + str(self.component_type) + ")"
+            return self._str
 
 
 class Field(StaticType):
@@ -218,22 +512,32 @@ class Field(StaticType):
     is stored in a field named field_type and the field names are stored in a
     field named field_names. 
     """
+    __slots__ = ("field_type", "field_names")
+    
     def __init__(self, field_type, *field_names):
         self.field_type = compile(field_type)
         self.field_names = list(field_names)
     
     def matches(self, value):
-        for name in self.field_names:
-            try:
-                field_value = getattr(value, name)
-                if not self.field_type.matches(field_value):
-                    return False
-            except AttributeError: # No such attribute, so return false
+        field_names = self.field_names
+        field_matches = self.field_type.matches
+        for name in field_names:
+            field_value = getattr(value, name, _MISSING)
+            if field_value is _MISSING: # No such attribute, so return false
+                return False
+            if not field_matches(field_value):
                 return False
         return True
     
+    def _key(self):
+        return (self.field_type, tuple(self.field_names))
+    
     def __str__(self):
-        return "Field(" + ", ".join([str(self.field_type)] + list(self.field_names)) + ")"
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "Field(" + ", ".join([str(self.field_type)] + list(self.field_names)) + ")"
+            return self._str
 
 
 class Iterable(StaticType):
@@ -242,15 +546,16 @@ class Iterable(StaticType):
     iterable if calling the Python function iter(value) does not raise a
     TypeError.
     """
+    __slots__ = ()
+    
     def __init__(self):
         pass
     
     def matches(self, value):
-        try:
-            iter(value)
-            return True
-        except TypeError:
-            return False
+        return _is_iterable(value)
+    
+    def _key(self):
+        return ()
     
     def __str__(self):
         return "Iterable()"
@@ -261,12 +566,13 @@ class Sequence(StaticType):
     A static type that matches a value if the value is a sequence. A value is
     defined to be a sequence if calling len(value) does not raise a TypeError.
     """
+    __slots__ = ()
+    
     def matches(self, value):
-        try:
-            len(value)
-            return True
-        except TypeError:
-            return False
+        return _is_sized(value)
+    
+    def _key(self):
+        return ()
     
     def __str__(self):
         return "Sequence()"
@@ -282,19 +588,39 @@ class Positional(StaticType):
     an integer, a string, and a boolean, at each respective position in the
     sequence.
     """
+    __slots__ = ("types", "_length")
+    
     def __init__(self, *types):
         self.types = [compile(type) for type in types]
+        self._length = len(self.types)
     
     def matches(self, value):
-        if len(self.types) != len(value):
+        try:
+            length = len(value)
+        except TypeError: # Not a sequence
             return False
-        for t, v in zip(self.types, value):
+        if length != self._length:
+            return False
+        types = self.types
+        if isinstance(value, (list, tuple)):
+            for i in range(length):
+                if not types[i].matches(value[i]):
+                    return False
+            return True
+        for t, v in zip(types, value):
             if not t.matches(v):
                 return False
         return True
     
+    def _key(self):
+        return tuple(self.types)
+    
     def __str__(self):
-        return "Positional(%s)" % ", ".join(str(t) for t in self.types)
+        try:
+            return self._str
+        except AttributeError:
+            self._str = "Positional(%s)" % ", ".join(str(t) for t in self.types)
+            return self._str
 
 
 class Is(StaticType):
@@ -302,27 +628,106 @@ class Is(StaticType):
     A static type that matches a value if the value is equal, as determined by
     the == operator, to a specified value.
     """
+    # See Type for what _match is for
+    __slots__ = ("value", "_match")
+    
     def __init__(self, value):
         self.value = value
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, Is):
+            value = self.value
+            self._match = lambda other: value == other
     
     def matches(self, value):
         return self.value == value
+    
+    def _key(self):
+        return (self.value,)
 
 
 class Everything(StaticType):
     """
     A static type that matches all values.
     """
+    # See Type for what _match is for
+    __slots__ = ("_match",)
+    
     def __init__(self):
-        pass
+        self._bind_match()
+    
+    def _bind_match(self):
+        if _uses_matches_of(self, Everything):
+            self._match = lambda value: True
     
     def matches(self, value):
         return True
     
+    def _key(self):
+        return ()
+    
     def __str__(self):
         return "Everything()"
 
 
+# Static types compiled from hashable short types (Python classes and tuples
+# of them, mostly), keyed by the short type. This is emptied whenever it
+# grows past _compile_cache_limit entries.
+_compile_cache = {}
+_compile_cache_limit = 1024
+# Every static type compiled from a short type that's still in use, keyed by
+# _intern_key. compile uses this to return the same static type object for
+# all short types that compile to equivalent static types.
+_interned = weakref.WeakValueDictionary()
+
+
+# Types whose instances are only equal to each other when they'd match the
+# same values, as long as they're of exactly the same type too. (1, True and
+# 1.0 are all equal, for example, but Is(1) and Is(True) aren't the same.)
+_plain_key_types = frozenset(six.integer_types + six.string_types +
+                             (bool, float, complex, bytes, _text_type, type(None)))
+
+
+def _intern_key(static_type):
+    """
+    Returns the key _intern files the specified static type under: its class
+    followed by its _key(), with each value in the latter paired up with its
+    type and each static type in the latter replaced with its own intern key.
+    Raises TypeError if the static type can't be interned.
+    """
+    key = static_type._key()
+    if key is None:
+        raise TypeError(str(type(static_type)) + " doesn't provide _key")
+    return (type(static_type),) + tuple([_intern_key_part(k) for k in key])
+
+
+def _intern_key_part(value):
+    if isinstance(value, StaticType):
+        try:
+            return _intern_key(value)
+        except TypeError: # Only the very same static type will do
+            return value
+    if isinstance(value, tuple):
+        return (type(value),) + tuple([_intern_key_part(v) for v in value])
+    if type(value) in _plain_key_types or isinstance(value, six.class_types):
+        return (type(value), value)
+    raise TypeError("Can't intern a static type containing " + repr(value))
+
+
+def _intern(static_type):
+    """
+    Returns the interned static type that's the same as the specified one,
+    interning the specified one if there isn't one yet. Static types that
+    can't be interned (see _intern_key) are returned as-is.
+    """
+    try:
+        key = _intern_key(static_type)
+    except TypeError:
+        return static_type
+    return _interned.setdefault(key, static_type)
+
+
 def compile(short_type):
     """
     Compiles the specified static type. This involves converting Python classes
@@ -332,17 +737,57 @@ def compile(short_type):
     
     This function is essentially analogous to Parcon and Pargen's promote
     functions.
+    
+    Short types that are hashable are only compiled once; the static type
+    compiled from them is cached and returned on subsequent calls. Static
+    types compiled from short types are also interned, so short types that
+    compile to equivalent static types (such as (int, str) and (int, (str,)))
+    give back the very same object.
     """
     if isinstance(short_type, StaticType): # Already compiled
         return short_type;
+    try:
+        return _compile_cache[short_type]
+    except KeyError:
+        result = _intern(_compile(short_type))
+        if len(_compile_cache) >= _compile_cache_limit:
+            _compile_cache.clear()
+        _compile_cache[short_type] = result
+        return result
+    except TypeError: # Not hashable, so it can't be cached
+        return _intern(_compile(short_type))
+
+
+def _compile_list(short_type):
+    if len(short_type) != 1:
+        raise TypeFormatError("Lists in types must be of length 1, but "
+                + str(short_type) + " has length " + str(len(short_type)))
+    component_type = short_type[0]
+    return All(component_type)
+
+
+def _compile_tuple(short_type):
+    return Or(*short_type)
+
+
+# Functions that compile short types, keyed by the exact class of the short
+# type. _compile checks this first so that the common cases (plain classes,
+# lists and tuples) only need one dictionary lookup.
+_compile_functions = {type: Type, list: _compile_list, tuple: _compile_tuple}
+
+
+def _compile(short_type):
+    """
+    Does the actual work of compile, without any caching.
+    """
+    function = _compile_functions.get(type(short_type))
+    if function is not None:
+        return function(short_type)
+    # Subclasses of list and tuple, and classes with metaclasses
     if isinstance(short_type, list):
-        if len(short_type) != 1:
-            raise TypeFormatError("Lists in types must be of length 1, but "
-                    + str(short_type) + " has length " + str(len(short_type)))
-        component_type = short_type[0]
-        return All(component_type)
+        return _compile_list(short_type)
     if isinstance(short_type, tuple):
-        return Or(*short_type)
+        return _compile_tuple(short_type)
     if not isinstance(short_type, type):
         raise TypeFormatError("Type " + str(short_type) + " is not an "
                 "instance of StaticType (or one of its subclasses) or a "
@@ -350,15 +795,27 @@ def compile(short_type):
     return Type(short_type)
 
 
+# The static type classes defined in this module. matches and check_matches
+# use this to skip compile when they're passed one of these directly.
+_STATIC_TYPE_CLASSES = frozenset([Type, Or, And, Not, All, Any, Field,
+                                  Iterable, Sequence, Positional, Is,
+                                  Everything])
+
+
 def matches(value, type):
     """
     Short for compile(type).matches(value).
     """
-    return compile(type).matches(value)
+    if type.__class__ in _STATIC_TYPE_CLASSES:
+        return _matcher(type)(value)
+    return _matcher(compile(type))(value)
 
 
 def check_matches(value, type):
     """
     Short for compile(type).check_matches(value).
     """
-    compile(type).check_matches(value)
\ No newline at end of file
+    if type.__class__ in _STATIC_TYPE_CLASSES:
+        type.check_matches(value)
+    else:
+        compile(type).check_matches(value)
\ No newline at end of file
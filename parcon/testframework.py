@@ -1,5 +1,6 @@
 from __future__ import print_function
-from traceback import print_exc
+import sys
+from traceback import print_exc, format_exc
 
 class TestException(Exception):
     pass
@@ -29,14 +30,57 @@ def check_raises(*args, **kwargs):
                                 " but raised " + str(type(e)) + " instead")
 
 
+# Results of subclasses_in_module, keyed by (c, modules, original). Classes
+# don't usually get defined after all of the modules being tested have been
+# imported, so these are kept until clear_subclass_cache is called.
+_subclass_cache = {}
+
+
+def clear_subclass_cache():
+    """
+    Forgets all of the results cached by subclasses_in_module. This should be
+    called if new subclasses might have been defined since it was last
+    called.
+    """
+    _subclass_cache.clear()
+
+
 def subclasses_in_module(c, modules=None, original=True):
+    """
+    Returns a list of all of the subclasses of c, direct or otherwise, that
+    are defined in one of the specified modules (or in any module, if modules
+    is None). c itself is included too if original is True.
+    
+    The class hierarchy is walked with an explicit stack rather than by
+    recursion, and each class is only visited once, even if it inherits from
+    c by more than one path. The result is cached, so the hierarchy is only
+    walked once for any given set of arguments; see clear_subclass_cache.
+    """
+    if isinstance(modules, (list, tuple, set)):
+        # Only membership in modules matters, so a frozenset lets the same
+        # modules given in a different order share a cache entry, and makes
+        # the membership test in _find_subclasses constant time
+        modules = frozenset(modules)
+    key = (c, modules, original)
+    result = _subclass_cache.get(key)
+    if result is None:
+        result = _find_subclasses(c, modules, original)
+        _subclass_cache[key] = result
+    return list(result)
+
+
+def _find_subclasses(c, modules, original):
     result = []
-    if original:
-        if modules is None or c.__module__ in modules:
-            result.append(c)
-    subclasses = c.__subclasses__()
-    for subclass in subclasses:
-        result += subclasses_in_module(subclass, modules)
+    visited = set([c])
+    stack = [c] if original else list(reversed(c.__subclasses__()))
+    visited.update(stack)
+    while stack:
+        k = stack.pop()
+        if modules is None or k.__module__ in modules:
+            result.append(k)
+        subclasses = [s for s in k.__subclasses__() if s not in visited]
+        visited.update(subclasses)
+        stack.extend(reversed(subclasses))
     return result
 
 
@@ -58,25 +102,39 @@ class TestSuite(object):
             print("WARNING: missing tests for " + str(list(targets - self.targets)))
             print("-" * 75)
     
-    def run_tests(self):
+    def run_tests(self, verbose=True):
+        """
+        Runs all of the tests in this suite and returns (passed, failed), the
+        number of tests that passed and failed. A report of each test's
+        outcome is collected as the tests run and written to standard output
+        all at once when they're done. If verbose is False, only failed tests
+        are reported.
+        """
         passed = 0
         failed = 0
+        report = []
         for test in self.tests:
-            target = getattr(test, "testing_target", None)
-            target_desc = str(target) if target is not None else "(no target)"
-            if target is not None and getattr(target, "__module__", None) is not None:
-                target_desc += " in module " + target.__module__
             try:
                 test()
-                print("TEST PASSED: " + test.__name__ + " testing " + target_desc)
                 passed += 1
+                if verbose:
+                    report.append("TEST PASSED: %s testing %s\n"
+                                  % (test.__name__, _describe_target(test.testing_target)))
             except:
-                print("TEST FAILED: " + test.__name__ + " testing " + target_desc)
-                print("Exception for the above failure:")
-                print_exc()
+                report.append("TEST FAILED: %s testing %s\n"
+                              % (test.__name__, _describe_target(test.testing_target)))
+                report.append("Exception for the above failure:\n")
+                report.append(format_exc())
                 failed += 1
+        sys.stdout.write("".join(report))
+        sys.stdout.flush()
         return passed, failed
 
 
-
-
+def _describe_target(target):
+    # Only called when a test's outcome is actually being reported
+    if target is None:
+        return "(no target)"
+    if getattr(target, "__module__", None) is not None:
+        return str(target) + " in module " + target.__module__
+    return str(target)
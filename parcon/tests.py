@@ -1,9 +1,22 @@
 from __future__ import print_function
 
 from parcon.testframework import *
+from functools import reduce
+import pickle
 import parcon
 from parcon import pargen
+from parcon import pargon
 from parcon import static
+from parcon.socket import LazyString
+from parcon import railroad as rr
+try:
+    # Checked separately so that raildraw doesn't complain about them being
+    # missing when it's imported
+    import cairo, pango, pangocairo
+except ImportError:
+    raildraw = None
+else:
+    from parcon.railroad import raildraw
 
 tests = []
 classes_tested = set()
@@ -44,6 +57,286 @@ def case(): #@DuplicatedSignature
     assert x.parse_string("5") == 5
 
 
+@test(parcon.Parser)
+def case(): #@DuplicatedSignature
+    # Parser.consume's memo should only last as long as parse_string, and
+    # shouldn't get confused by a nested parse_string call
+    space = parcon.Whitespace() | "#"
+    inner = parcon.Word(parcon.digit_chars)[...][lambda v: len(v)]
+    x = parcon.SignificantLiteral("(")[lambda v: inner.parse_string("1 # 2 3", whitespace=space)] + "x"
+    assert x.parse_string("  (# # x", whitespace=space) == 3
+    assert parcon._consume_state.caches is None
+    check_raises(Exception, x.parse_string, "(# y", whitespace=space)
+    assert parcon._consume_state.caches is None
+    assert x.parse_string("#(x#", whitespace=space) == 3
+
+
+class Shout(pargen.Literal):
+    # A Literal that overrides format instead of _format_into
+    __slots__ = ()
+    
+    def format(self, input):
+        return pargen.match(self.text.upper(), input)
+
+
+@test(pargen.Literal)
+def case(): #@DuplicatedSignature
+    x = pargen.Literal("abc")
+    assert x.format(5).text == "abc"
+    assert (x + pargen.String()).format(5).text == "abc5"
+    assert (pargen.Literal(b"a") + pargen.Literal(b"b")).format(None).text == b"ab"
+    x = Shout("abc")
+    assert x.format(5).text == "ABC"
+    assert (x + pargen.String()).format(5).text == "ABC5"
+    assert (pargen.Is(1) + x | pargen.String()).format(1).text == "ABC"
+    assert pargen.ForEach(x, ",").format([1, 2]).text == "ABC,ABC"
+
+
+class Never(pargen.Is):
+    # An Is that overrides format to never match
+    __slots__ = ()
+    
+    def format(self, input):
+        return pargen.failure()
+
+
+@test(pargen.Is)
+def case(): #@DuplicatedSignature
+    x = pargen.Is(1) & "one" | pargen.String()
+    assert x.format(1).text == "one"
+    assert x.format(2).text == "2"
+    x = Never(1) & "one" | pargen.String()
+    assert x.format(1).text == "1"
+    x = (pargen.Head(Shout("a")) + pargen.Head(pargen.String())
+         + pargen.Tail(pargen.String()))
+    assert x.format([1, 2, 3]).text == "A23"
+    assert pargen.And(pargen.String(), Shout("b")).format(1).text == "B"
+
+
+class Override(pargen.Forward):
+    # A Forward that overrides format
+    __slots__ = ()
+    
+    def format(self, input):
+        return pargen.match("override", input)
+
+
+@test(pargen.Forward)
+def case(): #@DuplicatedSignature
+    x = pargen.Forward()
+    y = "x" + x
+    x << pargen.String()
+    assert y.format(3).text == "x3"
+    x << Shout("a")
+    assert x.format(3).text == "A"
+    assert y.format(3).text == "xA"
+    x = Override(pargen.String())
+    assert x.format(3).text == "override"
+    assert ("x" + x).format(3).text == "xoverride"
+
+
+@test(pargon.ParserFormatter)
+def case(): #@DuplicatedSignature
+    x = pargon.ParserFormatter(parcon.SignificantLiteral("a"), Shout("a"))
+    assert x.parse_string("a") == "a"
+    assert x.format(None).text == "A"
+    assert (pargen.Forward(x) + "b").format(None).text == "Ab"
+    x = pargon.ParserFormatter(parcon.SignificantLiteral("a"), pargen.Forward(Shout("a")))
+    assert (pargen.Forward(x) + "b").format(None).text == "Ab"
+
+
+class SlowCharIn(parcon.CharIn):
+    # A CharIn that overrides parse, which keeps ZeroOrMore and OneOrMore off
+    # of their regex path
+    def parse(self, text, position, end, space):
+        return parcon.CharIn.parse(self, text, position, end, space)
+
+
+@test(parcon.ZeroOrMore)
+def case(): #@DuplicatedSignature
+    for chars in ["abc", "a-c]^\\"]:
+        fast, slow = parcon.CharIn(chars), SlowCharIn(chars)
+        assert parcon.ZeroOrMore(fast)._char_run is not None
+        assert parcon.ZeroOrMore(slow)._char_run is None
+        for text in ["", "x", "abcabx", "cc-]^\\x", "^^^"]:
+            for repeat in [parcon.ZeroOrMore, parcon.OneOrMore]:
+                for end in range(len(text) + 1):
+                    fast_result = repeat(fast).parse(text, 0, end, parcon.Invalid())
+                    slow_result = repeat(slow).parse(text, 0, end, parcon.Invalid())
+                    assert fast_result.end == slow_result.end
+                    assert fast_result.value == slow_result.value
+                    assert ([(p, e.format()) for p, e in fast_result.expected]
+                            == [(p, e.format()) for p, e in slow_result.expected])
+    x = parcon.Exact(parcon.Name("digit", parcon.CharIn(parcon.digit_chars))[...])
+    assert x.parse_string("0123") == list("0123")
+    # Whitespace between the characters still goes through the normal loop
+    assert parcon.CharIn("ab")[...].parse_string("a b  a") == list("aba")
+
+
+@test(pargen.First)
+def case(): #@DuplicatedSignature
+    # Formatters First can look up in a dictionary, checked against the same
+    # First without its dictionary
+    x = ((pargen.Is(True) & "true") | (pargen.Is(False) & "false")
+         | (pargen.Is(None) + "null") | (pargen.Is(1) & "one")
+         | (pargen.Is("a") & "letter") | (pargen.Is(2.5) & "float"))
+    assert x._switch is not None
+    y = pargen.First(*x.formatters)
+    y._switch = None
+    for input in [True, False, None, 1, 1.0, 0, 2, 2.5, "a", "b", b"a", [], [1], (True,), {}]:
+        x_result, y_result = x.format(input), y.format(input)
+        assert x_result.text == y_result.text
+        assert x_result.remainder == y_result.remainder
+    assert x.format(1).text == "true"
+    assert x.format(0).text == "false"
+    assert not x.format([1])
+    # Anything else in the First means it has to try each formatter in turn
+    x = (pargen.Is(1) & "one") | (pargen.Is(2) & "two") | pargen.String()
+    assert x._switch is None
+    assert x.format(2).text == "two"
+    assert x.format(3).text == "3"
+    assert ((pargen.Is(1) & "one") | (pargen.Is(1) & Shout("uno"))).format(1).text == "one"
+    assert ((pargen.Is(1) & Shout("uno")) | (pargen.Is(1) & "one")).format(1).text == "UNO"
+
+
+class Items(list):
+    # A sequence that _ExtremityRun doesn't handle itself
+    pass
+
+
+@test(pargen.Head)
+def case(): #@DuplicatedSignature
+    # Runs of Heads, Tails, Fronts and Backs, checked against the same
+    # formatters wrapped in Forwards, which keeps Then from grouping them
+    formatters = [pargen.Head(pargen.String()), pargen.Tail(pargen.Repr()),
+                  pargen.Front(pargen.String()), pargen.Back(pargen.String()),
+                  pargen.Head(pargen.Is("b") & "B"), pargen.Tail(Shout("t"))]
+    inputs = [[], [1], [1, 2], ["a", "b", "c"], ("a", "b", "c", "d"), "abcd",
+              "abcde", b"ab", Items(range(5)), [1, 2, 3, 4, 5, 6]]
+    for i in range(len(formatters)):
+        for j in range(i + 2, len(formatters) + 1):
+            run = formatters[i:j]
+            grouped = reduce(pargen.Then, run)
+            separate = reduce(pargen.Then, [pargen.Forward(f) for f in run])
+            for input in inputs:
+                grouped_result = grouped.format(input)
+                separate_result = separate.format(input)
+                assert bool(grouped_result) == bool(separate_result)
+                if grouped_result:
+                    assert grouped_result.text == separate_result.text
+                    assert grouped_result.remainder == separate_result.remainder
+    x = pargen.Head(pargen.String()) + pargen.Head(pargen.String()) + pargen.Back(pargen.String())
+    assert x.format([1, 2, 3, 4]).text == "124"
+    assert x.format([1, 2, 3, 4]).remainder == [3, 4]
+    assert x.format("xyz").remainder == "z"
+    assert not x.format([1])
+
+
+if raildraw is not None:
+    @test(rr.TokenRun)
+    def case(): #@DuplicatedSignature
+        options = raildraw.create_options({})
+        assert options.raildraw_token_run_length == 3
+        tokens = lambda type, texts: [rr.Token(type, t) for t in texts]
+        diagram = rr.Then(*(tokens(rr.TEXT, "abc") + [rr.Token(rr.PRODUCTION, "d")]
+                            + tokens(rr.TEXT, "ef") + tokens(rr.PRODUCTION, "gh")
+                            + [rr.Or(rr.Then(*tokens(rr.ANYCASE, "ijkl")),
+                                     rr.Loop(rr.Then(*tokens(rr.TEXT, "mno")),
+                                             rr.Then(*tokens(rr.TEXT, "pq"))))]))
+        original = diagram.structural_key()
+        prepared = raildraw.prepare_diagram(diagram, options)
+        # prepare_diagram works on a copy
+        assert diagram.structural_key() == original
+        expected = rr.Then(rr.TokenRun(rr.TEXT, "a", "b", "c"), rr.Token(rr.PRODUCTION, "d"),
+                           rr.Token(rr.TEXT, "e"), rr.Token(rr.TEXT, "f"),
+                           rr.Token(rr.PRODUCTION, "g"), rr.Token(rr.PRODUCTION, "h"),
+                           rr.Or(rr.Then(rr.TokenRun(rr.ANYCASE, "i", "j", "k", "l")),
+                                 rr.Loop(rr.Then(rr.TokenRun(rr.TEXT, "m", "n", "o")),
+                                         rr.Then(rr.Token(rr.TEXT, "p"), rr.Token(rr.TEXT, "q")))))
+        assert prepared.structural_key() == expected.structural_key()
+        options = raildraw.create_options({"raildraw_token_run_length": 2})
+        prepared = raildraw.prepare_diagram(rr.Then(*tokens(rr.TEXT, "ab")), options)
+        assert prepared.structural_key() == rr.Then(rr.TokenRun(rr.TEXT, "a", "b")).structural_key()
+        options = raildraw.create_options({"raildraw_token_run_length": None})
+        assert raildraw.prepare_diagram(diagram, options).structural_key() == original
+
+
+class Positive(static.Type):
+    # A Type that overrides matches and calls the original
+    __slots__ = ()
+    
+    def matches(self, value):
+        return static.Type.matches(self, value) and super(Positive, self).matches(value) and value > 0
+
+
+@test(static.Type)
+def case(): #@DuplicatedSignature
+    x = Positive(int)
+    assert x.matches(1)
+    assert not x.matches(-1)
+    assert not x.matches("a")
+    assert not static.Or(x, str).matches(-1)
+    assert static.Or(x, str).matches("a")
+    assert not static.And(x, int).matches(-1)
+    assert static.Not(x).matches(-1)
+    assert not static.matches(-1, x)
+    check_raises(static.StaticTypeError, x.check_matches, -1)
+    # Static types can be pickled, and still work afterward
+    for t in [static.Type(int), static.compile((int, str)), static.compile((int, [str])),
+              static.And(int, static.Not(bool)), static.Is(3), static.Everything(), x]:
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            u = pickle.loads(pickle.dumps(t, protocol))
+            for value in [1, -1, True, "a", ["a"], [1], 3, None]:
+                assert u.matches(value) == t.matches(value)
+                assert static.matches(value, u) == static.matches(value, t)
+
+
+@test(static.Is)
+def case(): #@DuplicatedSignature
+    # Static types compare by identity, and compile doesn't mix up values
+    # that are equal but of different types
+    assert static.Is(1) != static.Is(1)
+    a = static.compile((int, static.Is(1)))
+    assert static.Is(1) != static.Is(True)
+    for value in [True, 1.0, (True, 2), (1.0, 2)]:
+        b = static.compile((int, static.Is(value)))
+        assert b is not a
+        assert b.constructs[1].value == value
+        assert type(b.constructs[1].value) is type(value)
+    assert static.compile((int, str)) is static.compile((int, (str,)))
+    assert static.compile([(int, str)]) is static.compile([(int, str)])
+    assert static.compile((int, static.Is([1]))).matches([1])
+
+
+def lazy_string(data, padding=";"):
+    # A LazyString that reads data and then an endless run of padding
+    chunks = [data]
+    return LazyString(lambda size: chunks.pop() if chunks else padding * size)
+
+
+@test(LazyString)
+def case(): #@DuplicatedSignature
+    text = lazy_string("hello   world")
+    x = parcon.Literal("hello") + parcon.SignificantLiteral("world")
+    result = x.parse(text, 0, len(text), parcon.Whitespace())
+    assert result.end == 13
+    assert result.value == "world"
+    text = lazy_string("hello   there")
+    assert x.parse(text, 0, len(text), parcon.Whitespace()).end is None
+    # Runs of characters can't use the regex path on a LazyString
+    x = parcon.Exact(parcon.SignificantLiteral("hello") + parcon.SignificantLiteral(" ")
+                     + parcon.CharIn(parcon.alpha_chars)[...])
+    text = lazy_string("hello world")
+    result = x.parse(text, 0, len(text), parcon.Whitespace())
+    assert result.end == 11
+    assert result.value == ("hello", " ", list("world"))
+    x = parcon.Exact(+parcon.CharIn(parcon.digit_chars))
+    text = lazy_string("123")
+    assert x.parse(text, 0, len(text), parcon.Whitespace()).end == 3
+    text = lazy_string("abc")
+    assert x.parse(text, 0, len(text), parcon.Whitespace()).end is None
+
+
 def run_tests():
     targets = set()
     targets |= set(subclasses_in_module(parcon.Parser, ("parcon",)))